@@ -0,0 +1,138 @@
+"""Counts the stat family system calls which :meth:`Directory.explore` makes
+per child entry, with the legacy :func:`os.listdir` engine and with the
+:func:`os.scandir` engine.
+
+    $ python benchmarks/explore.py 80000
+"""
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+from flask_autoindex import Entry, RootDirectory
+
+
+class Counter(object):
+
+    def __init__(self):
+        self.calls = 0
+        self._stat, self._lstat, self._scandir = os.stat, os.lstat, os.scandir
+
+    def __enter__(self):
+        counter = self
+
+        def stat(*args, **kwargs):
+            counter.calls += 1
+            return counter._stat(*args, **kwargs)
+
+        def lstat(*args, **kwargs):
+            counter.calls += 1
+            return counter._lstat(*args, **kwargs)
+
+        def scandir(*args, **kwargs):
+            return _CountingScandir(counter._scandir(*args, **kwargs), counter)
+
+        os.stat, os.lstat, os.scandir = stat, lstat, scandir
+        return self
+
+    def __exit__(self, *exc_info):
+        os.stat, os.lstat, os.scandir = self._stat, self._lstat, self._scandir
+
+
+class _CountingScandir(object):
+    """Wraps a :func:`os.scandir` iterator. :class:`os.DirEntry` answers
+    ``is_dir()`` and ``is_file()`` from the ``d_type`` of ``readdir()``
+    without a system call except for symbolic links, and caches the result of
+    ``stat()``.
+    """
+
+    def __init__(self, iterator, counter):
+        self.iterator = iterator
+        self.counter = counter
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.iterator.close()
+
+    def __iter__(self):
+        for dirent in self.iterator:
+            yield _CountingDirEntry(dirent, self.counter)
+
+
+class _CountingDirEntry(object):
+
+    def __init__(self, dirent, counter):
+        self._dirent = dirent
+        self._counter = counter
+        self._stated = False
+
+    def __getattr__(self, attr):
+        return getattr(self._dirent, attr)
+
+    def _count(self):
+        if not self._stated:
+            self._stated = True
+            self._counter.calls += 1
+
+    def is_dir(self, **kwargs):
+        if self._dirent.is_symlink():
+            self._count()
+        return self._dirent.is_dir(**kwargs)
+
+    def is_file(self, **kwargs):
+        if self._dirent.is_symlink():
+            self._count()
+        return self._dirent.is_file(**kwargs)
+
+    def stat(self, **kwargs):
+        self._count()
+        return self._dirent.stat(**kwargs)
+
+
+def populate(path, count):
+    for x in range(count):
+        if x % 10:
+            open(os.path.join(path, 'file{0}.txt'.format(x)), 'w').close()
+        else:
+            os.mkdir(os.path.join(path, 'dir{0}'.format(x)))
+
+
+def legacy_explore(rootdir):
+    """The listing engine before the :func:`os.scandir` one."""
+    entries = []
+    for name in os.listdir(rootdir.abspath):
+        path = os.path.join(rootdir.path, name).replace(os.path.sep, '/')
+        try:
+            entries.append(Entry(path, rootdir))
+        except IOError:
+            continue
+    return entries
+
+
+def scandir_explore(rootdir):
+    return list(rootdir._scan(rootdir))
+
+
+def main(count=10000):
+    for engine in [legacy_explore, scandir_explore]:
+        # Each engine gets its own tree because entries are cached.
+        path = tempfile.mkdtemp()
+        try:
+            populate(path, count)
+            rootdir = RootDirectory(path)
+            started = time.perf_counter()
+            with Counter() as counter:
+                entries = engine(rootdir)
+            elapsed = time.perf_counter() - started
+        finally:
+            shutil.rmtree(path)
+        print('{0:>16}: {1} entries, {2:.2f} stats/entry, {3:.3f}s'.format(
+              engine.__name__, len(entries), counter.calls / len(entries),
+              elapsed))
+
+
+if __name__ == '__main__':
+    main(*map(int, sys.argv[1:]))
@@ -0,0 +1,54 @@
+"""Measures the cost per row of rendering a directory listing, and the time
+to the first byte of it.
+
+    $ python benchmarks/render.py 10000
+    $ python benchmarks/render.py 10000 5 stream
+"""
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+from flask import Flask
+from flask_autoindex import AutoIndex
+
+
+def populate(path, count):
+    exts = ['txt', 'py', 'png', 'zip', 'html', 'iso', 'mp3', 'csv', 'log', '']
+    for x in range(count):
+        name = 'file{0}.{1}'.format(x, exts[x % len(exts)]).rstrip('.')
+        open(os.path.join(path, name), 'w').close()
+
+
+def main(count=10000, repeat=5, stream=False):
+    path = tempfile.mkdtemp()
+    try:
+        populate(path, count)
+        app = Flask(__name__)
+        AutoIndex(app, path, stream=bool(stream))
+        client = app.test_client()
+        client.get('/')  # warms up templates and caches
+        timings = []
+        firsts = []
+        for x in range(repeat):
+            started = time.perf_counter()
+            rv = client.get('/', buffered=False)
+            chunks = iter(rv.response)
+            data = next(chunks)
+            firsts.append(time.perf_counter() - started)
+            data += b''.join(chunks)
+            timings.append(time.perf_counter() - started)
+            assert rv.status_code == 200
+            rv.close()
+    finally:
+        shutil.rmtree(path)
+    best = min(timings)
+    print('{0} rows: {1:.3f}s, {2:.1f}us/row, first byte {3:.1f}ms, '
+          '{4} bytes'.format(count, best, best / count * 1e6,
+                             min(firsts) * 1e3, len(data)))
+
+
+if __name__ == '__main__':
+    args = sys.argv[1:]
+    main(*map(int, args[:2]), stream='stream' in args[2:])
@@ -0,0 +1,50 @@
+"""Compares the rows of the default template rendered by Jinja2 and written
+by :class:`RowRenderer`, and checks that both make the same page.
+
+    $ python benchmarks/rows.py 10000
+    $ python benchmarks/rows.py 100000 3 stream
+"""
+import shutil
+import sys
+import tempfile
+import time
+
+from flask import Flask
+from flask_autoindex import AutoIndex
+
+from render import populate
+
+
+def measure(path, repeat, native_rows, stream):
+    app = Flask(__name__)
+    AutoIndex(app, path, native_rows=native_rows, stream=stream)
+    client = app.test_client()
+    client.get('/')  # warms up templates and caches
+    timings = []
+    for x in range(repeat):
+        started = time.perf_counter()
+        rv = client.get('/')
+        data = rv.data
+        timings.append(time.perf_counter() - started)
+        assert rv.status_code == 200
+    return min(timings), data
+
+
+def main(count=10000, repeat=5, stream=False):
+    path = tempfile.mkdtemp()
+    try:
+        populate(path, count)
+        jinja, jinja_data = measure(path, repeat, False, stream)
+        native, native_data = measure(path, repeat, True, stream)
+    finally:
+        shutil.rmtree(path)
+    assert jinja_data == native_data, 'the pages differ'
+    for label, best in [('jinja2', jinja), ('native', native)]:
+        print('{0} rows by {1}: {2:.3f}s, {3:.1f}us/row'.format(
+            count, label, best, best / count * 1e6))
+    print('{0:.2f}x, {1} bytes'.format(jinja / native, len(native_data)))
+
+
+if __name__ == '__main__':
+    args = sys.argv[1:]
+    main(*map(int, args[:2]), stream='stream' in args[2:])
@@ -1,17 +1,67 @@
+import gzip
+import hashlib
 import os
 import re
+import time
+import weakref
+from datetime import datetime, timezone
+from stat import S_ISDIR, S_ISREG
+from urllib.parse import quote as url_quote
 
 from flask import *
-from flask_silk import Silk
 from jinja2 import FileSystemLoader, TemplateNotFound
+from jinja2.filters import do_filesizeformat
+from werkzeug.http import is_resource_modified
 from werkzeug.utils import cached_property
 
 from . import icons
+from .assets import (CachedSilk, load_assets, send_asset, set_cache_control,
+                     silk_icons)
+from .archive import (ARCHIVE_MIMETYPES, ArchiveDirectory, ArchiveFile,
+                      archive_format, archive_name, archive_size,
+                      generate_archive)
+from .cache import (FileSystemPageCache, LRUCache, ListingCache,
+                    MemoryPageCache, PageCache, TemplateBytecodeCache,
+                    WeakLRUCache)
 from .entry import *
+from .entry import _IconMap, _IconRule
+from .compress import (SIDECAR_EXTENSIONS, accepted_encodings, compress,
+                       compress_stream, find_sidecar, negotiate)
+from .iconsheet import IconSheet, icon_class
+from .export import (EXPORT_MIMETYPES, entry_record, generate_csv,
+                     generate_json, generate_ndjson)
+from .mimetype import guess_file_type
+from .sendfile import OFFLOAD_HEADERS, serve_file, serve_fileobj
+from .pagination import Pagination, decode_cursor, resolve_cursor
+from .rows import DEFAULT_TEMPLATE, RowRenderer
 
 __version__ = '0.6.6'
 __autoindex__ = '__autoindex__'
 
+#: The ways to show icons in index pages.
+ICON_MODES = ('url', 'sprite', 'inline')
+
+_template_checksums = weakref.WeakKeyDictionary()
+
+
+def _stable_repr(value):
+    """Returns a representation of a template context value which is the
+    same in every process. Raises :exc:`TypeError` for other values than
+    strings, numbers and containers of them.
+    """
+    if value is None or isinstance(value, (str, bytes, bool, int, float)):
+        return repr(value)
+    elif isinstance(value, dict):
+        return '{{{0}}}'.format(', '.join(sorted(
+            '{0}: {1}'.format(_stable_repr(k), _stable_repr(v))
+            for k, v in value.items())))
+    elif isinstance(value, (list, tuple, set, frozenset)):
+        items = [_stable_repr(x) for x in value]
+        if isinstance(value, (set, frozenset)):
+            items.sort()
+        return '{0}({1})'.format(type(value).__name__, ', '.join(items))
+    raise TypeError('{0!r} has no stable representation'.format(value))
+
 
 class AutoIndex:
     """This class makes the Flask application to serve automatically
@@ -32,24 +82,113 @@ class AutoIndex:
     :param template_context: would be passed to the Jinja2 template when
                              rendering an AutoIndex page.
     :param silk_options: keyword options for :class:`flask_silk.Silk`.
+    :param listing_cache: a :class:`ListingCache` which keeps sorted listings
+                          of directories until they change. By default, a
+                          new one with default limits is used. ``False``
+                          disables caching.
+    :param watch: if it is ``True``, the default listing cache watches listed
+                  directories and drops their listings as soon as they
+                  change, instead of checking them on each request.
+    :param sniff_mimetypes: if it is ``True``, the mimetype of a file whose
+                            name doesn't tell is guessed from the first bytes
+                            of it.
+    :param per_page: the number of entries in a page of a listing. By default,
+                     listings are not paginated unless ``?limit=`` is given.
+    :param stream: if it is ``True``, index pages are streamed while they are
+                   rendered instead of being built in memory first.
+    :param page_cache: a :class:`PageCache` which keeps rendered pages until
+                       their directories change. By default, pages are
+                       rendered on every request.
+    :param compress: if it is ``True``, listings are compressed with gzip, or
+                     brotli if the :mod:`brotli` module is installed, for
+                     clients which accept it. Files are served from their
+                     ``.br`` or ``.gz`` sidecars if there are.
+    :param offload: ``'x-accel-redirect'`` for nginx or ``'x-sendfile'`` for
+                    Apache and lighttpd. If it is given, files are not sent
+                    by the application but only named by the header, and the
+                    front server sends them.
+    :param offload_root: where the front server finds the browse root. For
+                         ``'x-accel-redirect'``, it is the URI of an internal
+                         location, ``/`` by default. For ``'x-sendfile'``, it
+                         is a path, the browse root itself by default.
+    :param downloads: archive formats to download folders in, among
+                      ``'zip'``, ``'tar'`` and ``'tar.gz'``. Index pages link
+                      to them.
+    :param download_maxsize: the maximum total size of files in a downloaded
+                             folder. ``None`` means unlimited.
+    :param browse_archives: if it is ``True``, zip and tar archives can be
+                            browsed like folders at their paths followed by
+                            ``/``, and files in them are served.
+    :param icon_mode: how index pages show icons. ``'url'`` links each icon
+                      to the silk icon route. ``'sprite'`` links a single
+                      stylesheet which has every icon the icon rules can
+                      pick, and ``'inline'`` embeds icons as data URIs.
+    :param bytecode_cache: a directory to keep the compiled templates of
+                           Flask-AutoIndex in, which worker processes share,
+                           or a :class:`jinja2.BytecodeCache`. ``True`` means
+                           the default directory of Jinja2. Templates are
+                           compiled again whenever their sources change.
+    :param native_rows: if it is ``True``, the rows of the default template
+                        are written by :class:`RowRenderer` instead of
+                        Jinja2. The markup is the same. Custom templates are
+                        rendered by Jinja2 as before.
+    :param rootdir_cache: a :class:`WeakLRUCache` which keeps the root
+                          directories of this autoindex, including the
+                          `browse_root` of each :meth:`render_autoindex`
+                          call. By default, a new one which keeps 64 of them
+                          is used.
     """
 
+    #: The number of template chunks a streamed page sends at once.
+    stream_buffer = 100
+
+    #: The gzip compression level of pages in the page cache.
+    page_compresslevel = 6
+
+    #: The block size to read files which can't be handed to the server.
+    file_buffer_size = 1024 * 1024
+
     shared = None
 
     def _register_shared_autoindex(self, state=None, app=None):
         """Registers a magic module named __autoindex__."""
         app = app or state.app
+        template_folder = os.path.join(__path__[0], 'templates')
+        if self.bytecode_cache is not None:
+            self._use_bytecode_cache(app, template_folder)
         if __autoindex__ not in app.blueprints:
             static_folder = os.path.join(__path__[0], 'static')
-            template_folder = os.path.join(__path__[0], 'templates')
             shared = Blueprint(__autoindex__, __name__,
                                template_folder=template_folder)
 
+            assets = load_assets(static_folder)
+
             @shared.route('/__autoindex__/<path:filename>')
             def static(filename):
-                return send_from_directory(static_folder, filename)
+                return send_asset(assets, filename)
+
+            @shared.url_defaults
+            def add_version(endpoint, values):
+                """Links assets with their versions, so that browsers keep
+                them until they change.
+                """
+                asset = assets.get(values.get('filename'))
+                if endpoint == __autoindex__ + '.static' and \
+                   asset is not None:
+                    values.setdefault('v', asset.version)
             app.register_blueprint(shared)
 
+    def _use_bytecode_cache(self, app, template_folder):
+        """Makes the Jinja2 environment of `app` keep the compiled templates
+        of Flask-AutoIndex in :attr:`bytecode_cache`. Other templates are
+        left to the bytecode cache the environment had.
+        """
+        env = app.jinja_env
+        if isinstance(env.bytecode_cache, TemplateBytecodeCache):
+            return
+        env.bytecode_cache = TemplateBytecodeCache(
+            self.bytecode_cache, template_folder, env.bytecode_cache)
+
     def __new__(cls, base, *args, **kwargs):
         if isinstance(base, Flask):
             return object.__new__(AutoIndexApplication)
@@ -60,21 +199,66 @@ class AutoIndex:
 
     def __init__(self, base, browse_root=None, add_url_rules=True,
                  template_context=None, silk_options=None,
-                 show_hidden=False, sort_by='name', order=1):
+                 show_hidden=False, sort_by='name', order=1,
+                 listing_cache=None, watch=False, sniff_mimetypes=False,
+                 per_page=None, stream=False, page_cache=None,
+                 compress=False, offload=None, offload_root=None,
+                 downloads=(), download_maxsize=None,
+                 browse_archives=False, icon_mode='url',
+                 bytecode_cache=None, native_rows=False,
+                 rootdir_cache=None):
         """Initializes an autoindex instance."""
         self.base = base
         if browse_root:
             browse_root = str(browse_root)
         else:
             browse_root = os.path.curdir
+        if rootdir_cache is None:
+            rootdir_cache = WeakLRUCache(maxsize=64)
+        self.rootdir_cache = rootdir_cache
         self.rootdir = RootDirectory(browse_root, autoindex=self)
         self.template_context = template_context
         if silk_options is None:
             silk_options = {}
         silk_options['silk_path'] = silk_options.get('silk_path', '/__icons__')
-        self.silk = Silk(self.base, **silk_options)
+        #: The :class:`~flask_autoindex.assets.IconTable` to find icons in.
+        self.icon_table = silk_icons
+        self.silk = CachedSilk(self.base, self.icon_table, **silk_options)
+        self.base.add_url_rule(
+            silk_options['silk_path'] + '/<version>/<filename>',
+            'versioned_silkicon', self.send_icon)
+        if icon_mode not in ICON_MODES:
+            raise ValueError('icon_mode should be one of {0}.'.format(
+                ', '.join(ICON_MODES)))
+        self.icon_mode = icon_mode
+        self.icon_sheet = IconSheet(self, self.icon_table)
+        if icon_mode == 'sprite':
+            self.base.add_url_rule(silk_options['silk_path'] + '.css',
+                                   'autoindex_icons', self.send_icon_sheet)
         self.show_hidden = show_hidden
-        self.icon_map = []
+        self.sniff_mimetypes = sniff_mimetypes
+        self.per_page = per_page
+        self.stream = stream
+        self.page_cache = page_cache
+        self.compress = compress
+        if offload is not None and offload not in OFFLOAD_HEADERS:
+            raise ValueError('offload should be one of {0}.'.format(
+                ', '.join(sorted(OFFLOAD_HEADERS))))
+        self.offload = offload
+        self.offload_root = offload_root
+        for format in downloads:
+            if format not in ARCHIVE_MIMETYPES:
+                raise ValueError('Unknown archive format: {0}'.format(format))
+        self.downloads = list(downloads)
+        self.download_maxsize = download_maxsize
+        self.browse_archives = browse_archives
+        self.bytecode_cache = bytecode_cache
+        self.native_rows = native_rows
+        self._markup_times = LRUCache(maxsize=64)
+        if listing_cache is None:
+            listing_cache = ListingCache(watch=watch)
+        self.listing_cache = listing_cache
+        self.icon_map = _IconMap()
         self.converter_map = []
         if add_url_rules:
             @self.base.route('/')
@@ -96,13 +280,22 @@ class AutoIndex:
                                  rendering an AutoIndex page.
         :param endpoint: an endpoint which is a function.
         :param show_hidden: whether to show hidden files (starting with '.')
-        :param sort_by: the property to sort the entrys by.
+        :param sort_by: the property to sort the entrys by, one of
+                        ``'name'``, ``'modified'`` and ``'size'``. Comma
+                        separated properties such as ``'size,name'`` sort by
+                        several columns. Others sort by name.
         :param mimetype: set static mime type for files (no auto detection).
+
+        A directory is listed in JSON instead of HTML if the request has
+        ``?format=json`` or prefers ``application/json`` by its ``Accept``
+        header. ``?format=ndjson`` or ``?format=csv`` exports every
+        descendant of the directory instead.
         """
         if browse_root:
             rootdir = RootDirectory(browse_root, autoindex=self)
         else:
             rootdir = self.rootdir
+        trailing_slash = path.endswith('/')
         path = re.sub(r'\/*$', '', path)
         abspath = os.path.join(rootdir.abspath, path)
 
@@ -113,44 +306,557 @@ class AutoIndex:
         if relpath.startswith(os.path.pardir):
             return abort(403)
 
-        if os.path.isdir(abspath):
+        try:
+            stat = os.stat(abspath)
+        except OSError:
+            stat = None
+
+        curdir = None
+        if self.browse_archives and \
+           (stat is None or trailing_slash and S_ISREG(stat.st_mode)):
+            ent = self._archive_entry(rootdir, path)
+            if isinstance(ent, ArchiveFile):
+                return self._send_member(ent, mimetype)
+            elif ent is not None:
+                curdir, stat = ent, ent.archive.stat
+        if stat is None:
+            return abort(404)
+
+        if curdir is not None or S_ISDIR(stat.st_mode):
             sort_by = request.args.get('sort_by', sort_by)
-            if sort_by[0] in ['-', '+']:
+            if sort_by[:1] in ['-', '+']:
                 order = {'+': 1, '-': -1}[sort_by[0]]
                 sort_by = sort_by[1::]
             else:
                 order = {'asc': 1, 'desc': -1}[request.args.get('order', 'asc')]
-            curdir = Directory(path, rootdir)
+            if curdir is None:
+                curdir = Directory(path, rootdir)
             if show_hidden == None:
                 show_hidden = self.show_hidden
-            entries = curdir.explore(sort_by=sort_by, order=order,
-                                     show_hidden=show_hidden)
+            format = request.args.get('format')
+            if format in EXPORT_MIMETYPES:
+                return self._export(curdir, format, show_hidden)
+            download = request.args.get('download')
+            if download is not None and download in self.downloads:
+                return self._download(curdir, download, show_hidden)
+            wants_json = self._wants_json()
             if callable(endpoint):
                 endpoint = endpoint.__name__
+            native_rows = self.native_rows and not template
+            if not template:
+                template = ['{0}autoindex.html'.format(self.template_prefix),
+                            '{0}/autoindex.html'.format(__autoindex__)]
             context = {}
             if template_context is not None:
                 context.update(template_context)
             if self.template_context is not None:
                 context.update(self.template_context)
-            context.update(
-                curdir=curdir, entries=entries,
-                sort_by=sort_by, order=order, endpoint=endpoint)
-            if template:
-                return render_template(template, **context)
-            try:
-                template = '{0}autoindex.html'.format(self.template_prefix)
-                return render_template(template, **context)
-            except TemplateNotFound as e:
-                template = '{0}/autoindex.html'.format(__autoindex__)
-                return render_template(template, **context)
-        elif os.path.isfile(abspath):
-            if mimetype:
-                return send_file(abspath, mimetype=mimetype)
+            markup = self._markup_key(template, wants_json)
+            etag = self._listing_etag(curdir, stat, sort_by, order,
+                                      show_hidden, wants_json, template,
+                                      endpoint, context, markup)
+            last_modified = datetime.fromtimestamp(
+                int(max(stat.st_mtime, self._markup_since(markup))),
+                timezone.utc)
+            encoding = self._listing_encoding()
+            if etag is not None and \
+               not is_resource_modified(request.environ,
+                                        self._variant_etag(etag, encoding),
+                                        last_modified=last_modified):
+                response = Response(status=304)
+                return self._add_validators(response, etag, last_modified,
+                                            encoding or '')
+            listing_type = 'application/json' if wants_json else 'text/html'
+            page_key = None
+            if self.page_cache is not None and etag is not None:
+                page_key = self._page_key(etag, template, endpoint)
+                page = self.page_cache.get(page_key)
+                if page is not None:
+                    response = self._page_response(page, listing_type,
+                                                   encoding)
+                    return self._add_validators(response, etag, last_modified)
+            limit = request.args.get('limit', self.per_page, type=int)
+            if limit is not None and limit > 0:
+                pagination = self._paginate(curdir, sort_by, order,
+                                            show_hidden, stat, limit)
+                entries, total = pagination.entries, pagination.total
             else:
-                return send_file(abspath)
+                pagination = None
+                entries, total = self._sort_children(curdir, sort_by, order,
+                                                     show_hidden, stat)
+            if wants_json:
+                body = generate_json(curdir, entries, total, pagination)
+            else:
+                if not curdir.is_root():
+                    entries = [curdir.parent_entry] + entries
+                context.update(
+                    curdir=curdir, entries=entries,
+                    sort_by=sort_by, order=order, endpoint=endpoint,
+                    pagination=pagination, downloads=self.downloads,
+                    render_icon=self._icon_renderer(),
+                    icon_sheet=self.icon_sheet
+                    if self.icon_mode == 'sprite' else None)
+                if native_rows:
+                    native_rows = self._default_template(template)
+                if native_rows:
+                    body = self._render_rows(native_rows, context)
+                elif self.stream:
+                    body = self._stream_template(template, context)
+                else:
+                    body = render_template(template, **context)
+            response = self._listing_response(body, listing_type,
+                                              encoding, page_key)
+            return self._add_validators(response, etag, last_modified)
+        elif S_ISREG(stat.st_mode):
+            encoding = None
+            if not mimetype:
+                mimetype, encoding = guess_file_type(abspath, stat,
+                                                     self.sniff_mimetypes)
+                if mimetype is None:
+                    mimetype = 'application/octet-stream'
+            if encoding is None and self.compress:
+                response = self._send_sidecar(abspath, stat, mimetype,
+                                              rootdir)
+                if response is not None:
+                    return response
+            return serve_file(abspath, mimetype, stat, encoding,
+                              self.file_buffer_size,
+                              self._offload(abspath, rootdir))
         else:
             return abort(404)
 
+    def warm_up(self, app=None):
+        """Compiles the templates of index pages, or loads them from the
+        bytecode cache, so that the first request doesn't wait for it. Call
+        it when the application starts. Returns the loaded templates.
+
+        :param app: the application. By default, the wrapped application or
+                    the current application for blueprints.
+        """
+        if app is None:
+            app = getattr(self, 'app', None) or current_app
+        env = app.jinja_env
+        return [env.get_or_select_template([
+                    '{0}autoindex.html'.format(self.template_prefix),
+                    '{0}/autoindex.html'.format(__autoindex__)]),
+                env.get_template('{0}/macros.html'.format(__autoindex__))]
+
+    def send_icon_sheet(self):
+        """Sends the stylesheet of icons for the ``'sprite'`` icon mode.
+        Index pages link it with its version, so such a link is cached for a
+        year.
+        """
+        sheet = self.icon_sheet
+        if self.compress:
+            encoding = negotiate(request.accept_encodings)
+        else:
+            encoding = None
+        if encoding is None:
+            response = Response(sheet.css, mimetype='text/css')
+        else:
+            response = Response(compress(sheet.css.encode('utf-8'), encoding,
+                                         9), mimetype='text/css')
+            response.content_encoding = encoding
+            response.vary.add('Accept-Encoding')
+        response.set_etag(sheet.version + (encoding or ''))
+        set_cache_control(response, request.args.get('v') == sheet.version)
+        return response.make_conditional(request)
+
+    def send_icon(self, filename, version=None):
+        """Sends a silk icon. It is cached for a year if `version` is the
+        current hash of its content.
+        """
+        return self.icon_table.send(filename, version)
+
+    def _icon_renderer(self):
+        """Returns a function which renders the icon of an entry for
+        :attr:`icon_mode`. Icons which are not in the icon sheet, such as
+        those picked by functions, are linked by their urls. Each icon is
+        rendered once per function.
+        """
+        uris = {} if self.icon_mode == 'url' else self.icon_sheet.uris()
+        sprite = self.icon_mode == 'sprite'
+        rendered = {}
+        def render_icon(ent):
+            icon = ent.guess_icon_name()
+            if not icon:
+                return ''
+            try:
+                return rendered[icon]
+            except KeyError:
+                pass
+            if sprite and icon in uris:
+                markup = Markup('<span class="sprite {0}"></span>').format(
+                    icon_class(icon))
+            else:
+                src = uris.get(icon) or icon_url(icon)
+                markup = Markup('<img src="{0}" />').format(src)
+            rendered[icon] = markup
+            return markup
+        return render_icon
+
+    def _listing_etag(self, directory, stat, sort_by, order, show_hidden,
+                      wants_json, template, endpoint, context, markup):
+        """Makes a strong ETag for a listing from the stat fingerprint of the
+        directory and everything else which changes the listing, including
+        the options and the template source. Returns
+        ``None`` if the extra template context has a value which can't be
+        told apart stably, then the listing is neither validated nor cached.
+        """
+        try:
+            context = _stable_repr(context)
+        except TypeError:
+            return None
+        environ = request.environ
+        # The footer of the default template shows these.
+        server = (environ.get('SERVER_SOFTWARE'), environ.get('HTTP_HOST'),
+                  environ.get('SERVER_PORT'))
+        key = (ListingCache.fingerprint(stat), directory.abspath,
+               sort_by, order, show_hidden, wants_json,
+               sorted(request.args.items(multi=True)), template, endpoint,
+               context, server, markup, __version__)
+        return hashlib.sha1(repr(key).encode('utf-8')).hexdigest()
+
+    def _listing_encoding(self):
+        """Returns the content-coding which a listing is sent in for the
+        current request, or ``None``. Listings are compressed if
+        :attr:`compress` is set, and otherwise pages of the page cache are
+        sent gzipped to clients which accept gzip. Conditional requests are
+        answered for this variant only.
+        """
+        if self.compress:
+            return negotiate(request.accept_encodings)
+        elif self.page_cache is not None and request.accept_encodings['gzip']:
+            return 'gzip'
+        return None
+
+    def _variant_etag(self, etag, encoding):
+        """Makes the ETag of a content-coding of a listing. Each coding is a
+        different representation, so it has its own ETag.
+        """
+        if not encoding:
+            return etag
+        return '{0}-{1}'.format(etag, encoding)
+
+    def _add_validators(self, response, etag, last_modified, encoding=None):
+        """Sets the ETag, Last-Modified and Vary headers of a listing. The
+        ETag depends on the content-coding of the response, or `encoding` if
+        it is given. A listing without `etag` gets only the Vary header.
+        """
+        if etag is not None:
+            if encoding is None:
+                encoding = response.content_encoding
+            response.set_etag(self._variant_etag(etag, encoding))
+            response.last_modified = last_modified
+        response.vary.add('Accept')
+        if self.page_cache is not None or self.compress:
+            response.vary.add('Accept-Encoding')
+        return response
+
+    def _offload(self, path, rootdir):
+        """Returns the header and its value which make the front server send
+        the file at `path`, or ``None`` if files are not offloaded.
+        """
+        if self.offload is None:
+            return None
+        relpath = os.path.relpath(path, rootdir.abspath)
+        relpath = relpath.replace(os.path.sep, '/')
+        if self.offload == 'x-accel-redirect':
+            location = (self.offload_root or '/').rstrip('/')
+            value = location + '/' + url_quote(relpath)
+        else:
+            value = os.path.join(self.offload_root or rootdir.abspath, relpath)
+        return (OFFLOAD_HEADERS[self.offload], value)
+
+    def _send_sidecar(self, path, stat, mimetype, rootdir):
+        """Sends a pre-compressed sidecar of a file, such as ``style.css.gz``
+        for ``style.css``, if the client accepts its content coding. Returns
+        ``None`` if there is no such sidecar.
+        """
+        encodings = accepted_encodings(request.accept_encodings,
+                                       list(SIDECAR_EXTENSIONS))
+        sidecar, encoding = find_sidecar(path, stat, encodings)
+        if sidecar is None:
+            return None
+        response = serve_file(sidecar, mimetype, encoding=encoding,
+                              buffer_size=self.file_buffer_size,
+                              offload=self._offload(sidecar, rootdir))
+        response.vary.add('Accept-Encoding')
+        return response
+
+    def _archive_entry(self, rootdir, path):
+        """Returns the :class:`ArchiveDirectory` or :class:`ArchiveFile` at
+        `path` if it is in an archive which can be browsed, or ``None``.
+        """
+        parts = path.split('/')
+        for depth in range(1, len(parts) + 1):
+            try:
+                stat = os.stat(os.path.join(rootdir.abspath, *parts[:depth]))
+            except OSError:
+                return None
+            if S_ISREG(stat.st_mode):
+                break
+            elif not S_ISDIR(stat.st_mode):
+                return None
+        else:
+            return None
+        if archive_format(parts[depth - 1]) is None:
+            return None
+        archive = File('/'.join(parts[:depth]), rootdir)
+        archive._stat = stat
+        try:
+            ent = ArchiveDirectory(archive)
+            if depth < len(parts):
+                ent = ent.get_child('/'.join(parts[depth:]))
+        except (IOError, ValueError):
+            return None
+        return ent
+
+    def _send_member(self, ent, mimetype=None):
+        """Streams a file out of an archive."""
+        encoding = None
+        if not mimetype:
+            mimetype, encoding = ent.mimetype
+            if mimetype is None:
+                mimetype = 'application/octet-stream'
+        key = (ListingCache.fingerprint(ent.archive.stat), ent.path)
+        etag = hashlib.sha1(repr(key).encode('utf-8')).hexdigest()
+        try:
+            f = ent.open()
+        except IOError:
+            return abort(403, 'The file can\'t be extracted.')
+        return serve_fileobj(f, ent.name, mimetype, ent.size,
+                             ent.stat.st_mtime, etag, encoding,
+                             self.file_buffer_size)
+
+    def _download(self, directory, format, show_hidden):
+        """Streams an archive of the subtree of a directory."""
+        if self.download_maxsize is not None and \
+           archive_size(directory, show_hidden,
+                        self.download_maxsize) is None:
+            return abort(403, 'The folder is too large to download.')
+        body = generate_archive(directory, format, show_hidden,
+                                self.file_buffer_size)
+        response = Response(stream_with_context(body),
+                            mimetype=ARCHIVE_MIMETYPES[format])
+        filename = '{0}.{1}'.format(archive_name(directory), format)
+        response.headers.set('Content-Disposition', 'attachment',
+                             filename=filename)
+        return response
+
+    def _export(self, directory, format, show_hidden):
+        """Streams a record for each descendant of a directory as NDJSON or
+        CSV. ``?depth=`` limits the depth and ``?after=`` resumes after the
+        path of the last received record.
+        """
+        depth = request.args.get('depth', type=int)
+        try:
+            descendants = directory.walk(depth, show_hidden,
+                                         request.args.get('after'),
+                                         confine=True)
+        except ValueError:
+            return abort(400)
+        records = (entry_record(ent) for ent in descendants)
+        if format == 'csv':
+            body = generate_csv(records)
+        else:
+            body = generate_ndjson(records)
+        return Response(stream_with_context(body),
+                        mimetype=EXPORT_MIMETYPES[format])
+
+    def _wants_json(self):
+        """Returns ``True`` if the request asks for a JSON listing by
+        ``?format=json`` or the ``Accept`` header.
+        """
+        format = request.args.get('format')
+        if format is not None:
+            return format == 'json'
+        best = request.accept_mimetypes.best_match(['text/html',
+                                                    'application/json'])
+        return best == 'application/json'
+
+    def _stream_template(self, template, context):
+        """Returns an iterable which renders the template while it is sent.
+
+        :param template: the template name or a list of template names to try.
+        """
+        app = current_app._get_current_object()
+        app.update_template_context(context)
+        template = app.jinja_env.get_or_select_template(template)
+        stream = template.stream(context)
+        stream.enable_buffering(self.stream_buffer)
+        return stream
+
+    def _default_template(self, template):
+        """Returns the default template if `template` selects it, or ``None``
+        if the application overrides it.
+        """
+        env = current_app.jinja_env
+        template = env.get_or_select_template(template)
+        if template.filename != DEFAULT_TEMPLATE or \
+           env.filters.get('filesizeformat') is not do_filesizeformat:
+            return None
+        return template
+
+    def _render_rows(self, template, context):
+        """Renders the default template without entries, and writes the rows
+        of the entries by :class:`RowRenderer` right after its ``<tbody>``.
+        Returns UTF-8 bytes, or an iterable of byte chunks if :attr:`stream`
+        is set.
+        """
+        entries = context['entries']
+        context['entries'] = []
+        head, tbody, tail = render_template(template, **context) \
+            .partition('<tbody>')
+        rows = RowRenderer(context['endpoint'], context['render_icon'])
+        if self.stream:
+            def generate():
+                yield (head + tbody).encode('utf-8')
+                for chunk in rows.iter_chunks(entries, self.stream_buffer):
+                    yield chunk
+                yield tail.encode('utf-8')
+            return generate()
+        chunks = [(head + tbody).encode('utf-8')]
+        rows.write(entries, chunks, self.stream_buffer)
+        chunks.append(tail.encode('utf-8'))
+        return b''.join(chunks)
+
+    def _page_key(self, etag, template, endpoint):
+        """Makes the key of a rendered page in the page cache. The ETag
+        already covers the options and the template source.
+        """
+        key = (etag, template, endpoint, request.script_root)
+        return hashlib.sha1(repr(key).encode('utf-8')).hexdigest()
+
+    def _markup_key(self, template, wants_json):
+        """Returns what changes a listing besides the directory and the
+        request: the options of this instance, and the name, the file name
+        and a checksum of the source of the template unless the listing is
+        JSON. Page caches may be shared by processes, so all of them are
+        values which every process tells alike.
+        """
+        options = (self.icon_mode, tuple(self.downloads), self.native_rows,
+                   self.per_page, self.stream, self.browse_archives,
+                   self.sniff_mimetypes)
+        if wants_json:
+            return options
+        env = current_app.jinja_env
+        template = env.get_or_select_template(template)
+        checksum = _template_checksums.get(template)
+        if checksum is None:
+            try:
+                source = env.loader.get_source(env, template.name)[0]
+            except TemplateNotFound:
+                source = ''
+            checksum = hashlib.sha1(source.encode('utf-8')).hexdigest()
+            # A changed source is loaded as another template object.
+            _template_checksums[template] = checksum
+        return options + (template.name, template.filename, checksum)
+
+    def _markup_since(self, markup):
+        """Returns when this process first saw a key of :meth:`_markup_key`.
+        Listings are not older than it, so ``If-Modified-Since`` doesn't
+        keep the markup from before the options or the template changed.
+        """
+        since = self._markup_times.get(markup)
+        if since is None:
+            since = time.time()
+            self._markup_times.set(markup, since)
+        return since
+
+    def _listing_response(self, body, mimetype, encoding, page_key=None):
+        """Makes the response of a rendered listing. The listing is stored in
+        the page cache if `page_key` is given.
+
+        :param body: the rendered listing or an iterable of its chunks.
+        :param encoding: the content-coding to send the listing in, from
+                         :meth:`_listing_encoding`.
+        """
+        if isinstance(body, (str, bytes)):
+            page = None
+            if page_key is not None:
+                page = self._cache_page(page_key, body)
+            if encoding == 'gzip' and page is not None:
+                body = page
+            elif encoding is not None:
+                if isinstance(body, str):
+                    body = body.encode('utf-8')
+                body = compress(body, encoding, self.page_compresslevel)
+        else:
+            if page_key is not None:
+                body = self._tee_page(page_key, body)
+            if encoding is not None:
+                body = compress_stream(body, encoding,
+                                       self.page_compresslevel)
+            body = stream_with_context(body)
+        response = Response(body, mimetype=mimetype)
+        if encoding is not None:
+            response.content_encoding = encoding
+        return response
+
+    def _cache_page(self, key, body):
+        """Stores a rendered page gzipped in the page cache and returns the
+        gzipped page.
+        """
+        if isinstance(body, str):
+            body = body.encode('utf-8')
+        page = gzip.compress(body, self.page_compresslevel)
+        self.page_cache.set(key, page)
+        return page
+
+    def _tee_page(self, key, chunks):
+        rendered = []
+        for chunk in chunks:
+            if isinstance(chunk, str):
+                rendered.append(chunk.encode('utf-8'))
+            else:
+                rendered.append(chunk)
+            yield chunk
+        self._cache_page(key, b''.join(rendered))
+
+    def _page_response(self, page, mimetype, encoding):
+        """Makes a response of a gzipped page from the page cache. It is sent
+        as it is if `encoding` is gzip.
+        """
+        if encoding != 'gzip':
+            page = gzip.decompress(page)
+            if encoding is not None:
+                page = compress(page, encoding, self.page_compresslevel)
+        response = Response(page, mimetype=mimetype)
+        if encoding is not None:
+            response.content_encoding = encoding
+        return response
+
+    def _sort_children(self, directory, sort_by, order, show_hidden,
+                       stat=None, limit=None):
+        """Sorts the children of a directory through the listing cache.
+        Archives are sorted from their cached indexes instead.
+        """
+        if self.listing_cache and not isinstance(directory, ArchiveDirectory):
+            return self.listing_cache.sort_children(directory, sort_by, order,
+                                                    show_hidden, stat, limit)
+        return directory.sort_children(sort_by, order, show_hidden, limit)
+
+    def _paginate(self, directory, sort_by, order, show_hidden, stat, limit):
+        """Makes the :class:`Pagination` for the requested page. Only the
+        entries up to the end of the page are sorted.
+        """
+        page = max(1, request.args.get('page', 1, type=int))
+        cursor = decode_cursor(request.args.get('cursor', ''))
+        offset = cursor[0] if cursor else (page - 1) * limit
+        children, total = self._sort_children(directory, sort_by, order,
+                                              show_hidden, stat, offset + limit)
+        if cursor:
+            offset = resolve_cursor(cursor, children)
+            if offset + limit > len(children) < total:
+                children, total = self._sort_children(
+                    directory, sort_by, order, show_hidden, stat,
+                    offset + limit)
+        args = dict((key, value) for key, value in request.args.items()
+                    if key not in ('page', 'limit', 'cursor'))
+        return Pagination(offset // limit + 1, limit, total, offset,
+                          children[offset:offset + limit], args)
+
     def add_icon_rule(self, icon, rule=None, ext=None, mimetype=None,
                       name=None, filename=None, dirname=None, cls=None):
         """Adds a new icon rule.
@@ -209,20 +915,25 @@ class AutoIndex:
         """
         if name:
             filename = name
-            directoryname = name
-        call = lambda m, *args: m.__func__(self, *args)
+            dirname = name
+        to_list = lambda val: val if isinstance(val, list) else [val]
+        rules = []
         if ext:
-            call(File.add_icon_rule_by_ext, icon, ext)
+            rules.extend(_IconRule('ext', x, File) for x in to_list(ext))
         if mimetype:
-            call(File.add_icon_rule_by_mimetype, icon, mimetype)
+            rules.extend(_IconRule('mimetype', x, File)
+                         for x in to_list(mimetype))
         if filename:
-            call(File.add_icon_rule_by_name, icon, filename)
+            rules.extend(_IconRule('name', x, File) for x in to_list(filename))
         if dirname:
-            call(Directory.add_icon_rule_by_name, icon, dirname)
+            rules.extend(_IconRule('name', x, Directory)
+                         for x in to_list(dirname))
         if cls:
-            call(Entry.add_icon_rule_by_class, icon, cls)
+            rules.append(_IconRule('class', cls))
         if callable(rule) or callable(icon):
-            call(Entry.add_icon_rule, icon, rule)
+            rules.append(rule)
+        for rule in rules:
+            self.icon_map.append((icon, rule))
 
     @property
     def template_prefix(self):
@@ -0,0 +1,485 @@
+# -*- coding: utf-8 -*-
+import os
+import posixpath
+import re
+import tarfile
+import time
+import zipfile
+import zlib
+from stat import S_IFDIR, S_IFREG, S_ISDIR
+
+from .cache import LRUCache, ListingCache
+from .entry import Directory, Entry, File, _ParentDirectory
+from .mimetype import guess_type
+
+
+#: The mimetypes of archive formats.
+ARCHIVE_MIMETYPES = {'zip': 'application/zip', 'tar': 'application/x-tar',
+                     'tar.gz': 'application/gzip'}
+
+#: Files of these mimetypes are already compressed, so they are stored in zip
+#: archives as they are.
+STORED_MIMETYPES = ('image/jpeg', 'image/png', 'image/gif', 'image/webp',
+                    'audio/', 'video/', 'application/zip',
+                    'application/gzip', 'application/x-7z-compressed',
+                    'application/x-bzip2', 'application/x-xz',
+                    'application/x-rar-compressed', 'application/pdf')
+
+#: The file extensions of archives which can be browsed and their formats.
+BROWSE_EXTENSIONS = (('.zip', 'zip'), ('.tar', 'tar'), ('.tar.gz', 'tar'),
+                     ('.tgz', 'tar'), ('.tar.bz2', 'tar'), ('.tbz2', 'tar'),
+                     ('.tar.xz', 'tar'), ('.txz', 'tar'))
+
+#: The magic numbers of gzip, bzip2 and xz streams.
+COMPRESSED_MAGIC = (b'\x1f\x8b', b'BZh', b'\xfd7zXZ\x00')
+
+_indexes = LRUCache(maxsize=64)
+
+
+class _Sink(object):
+    """A write-only file which keeps what is written until it is drained."""
+
+    def __init__(self):
+        self._chunks = []
+
+    def write(self, data):
+        self._chunks.append(bytes(data))
+        return len(data)
+
+    def flush(self):
+        pass
+
+    def drain(self):
+        data = b''.join(self._chunks)
+        self._chunks = []
+        return data
+
+
+def archive_name(directory):
+    """Returns the name of the top directory in an archive of `directory`."""
+    return directory.name if directory.name != '.' else 'root'
+
+
+def archive_size(directory, show_hidden=False, maxsize=None):
+    """Returns the total size of files in the subtree of `directory`. It stops
+    counting and returns ``None`` as soon as the total exceeds `maxsize`.
+    """
+    total = 0
+    for ent in directory.walk(show_hidden=show_hidden, confine=True):
+        if not isinstance(ent, Directory):
+            total += ent.size
+            if maxsize is not None and total > maxsize:
+                return None
+    return total
+
+
+def _members(directory, show_hidden):
+    """Yields each descendant of `directory` and its name in an archive."""
+    top = archive_name(directory)
+    skip = 0 if directory.is_root() else len(directory.path.rstrip('/')) + 1
+    yield directory, top
+    for ent in directory.walk(show_hidden=show_hidden, confine=True):
+        yield ent, top + '/' + ent.path[skip:]
+
+
+def _stored(name):
+    mimetype, encoding = guess_type(name)
+    return encoding is not None or \
+        mimetype is not None and mimetype.startswith(STORED_MIMETYPES)
+
+
+def _open(ent):
+    try:
+        return ent.open()
+    except OSError:
+        return None  # skip unreadable files
+
+
+def generate_archive(directory, format, show_hidden=False,
+                     buffer_size=1024 * 1024):
+    """Yields an archive of the subtree of `directory` piece by piece while
+    walking it, without temporary files. Memory use doesn't depend on the
+    size of the subtree.
+
+    :param directory: the directory to archive.
+    :param format: ``'zip'``, ``'tar'`` or ``'tar.gz'``.
+    :param show_hidden: whether to archive hidden entries.
+    :param buffer_size: the block size to read files.
+    """
+    members = _members(directory, show_hidden)
+    if format == 'zip':
+        return _generate_zip(members, buffer_size)
+    return _generate_tar(members, format == 'tar.gz', buffer_size)
+
+
+def _generate_zip(members, buffer_size):
+    sink = _Sink()
+    # Zip64 extensions are written only where sizes or offsets need them.
+    with zipfile.ZipFile(sink, 'w', allowZip64=True) as zf:
+        for ent, name in members:
+            stat = ent.stat
+            date_time = time.localtime(max(stat.st_mtime, 315532800))[:6]
+            if isinstance(ent, Directory):
+                zinfo = zipfile.ZipInfo(name + '/', date_time)
+                zinfo.external_attr = (stat.st_mode & 0xffff) << 16 | 0x10
+                zf.writestr(zinfo, b'')
+                yield sink.drain()
+                continue
+            f = _open(ent)
+            if f is None:
+                continue
+            with f:
+                zinfo = zipfile.ZipInfo(name, date_time)
+                zinfo.external_attr = (stat.st_mode & 0xffff) << 16
+                zinfo.file_size = stat.st_size
+                if _stored(name):
+                    zinfo.compress_type = zipfile.ZIP_STORED
+                else:
+                    zinfo.compress_type = zipfile.ZIP_DEFLATED
+                with zf.open(zinfo, 'w') as member:
+                    while True:
+                        data = f.read(buffer_size)
+                        if not data:
+                            break
+                        member.write(data)
+                        data = sink.drain()
+                        if data:
+                            yield data
+            yield sink.drain()
+    yield sink.drain()
+
+
+def _generate_tar(members, compress, buffer_size):
+    if compress:
+        compressor = zlib.compressobj(6, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+        encode = compressor.compress
+    else:
+        encode = lambda data: data
+    written = 0
+    for ent, name in members:
+        stat = ent.stat
+        tarinfo = tarfile.TarInfo(name)
+        tarinfo.mtime = int(stat.st_mtime)
+        tarinfo.mode = stat.st_mode & 0o7777
+        if isinstance(ent, Directory):
+            tarinfo.type = tarfile.DIRTYPE
+            f = None
+        else:
+            f = _open(ent)
+            if f is None:
+                continue
+            tarinfo.size = stat.st_size
+        # The PAX format has no limit of names and sizes.
+        header = tarinfo.tobuf(tarfile.PAX_FORMAT, 'utf-8', 'surrogateescape')
+        written += len(header)
+        yield encode(header)
+        if f is None:
+            continue
+        with f:
+            remaining = tarinfo.size
+            while remaining > 0:
+                data = f.read(min(buffer_size, remaining))
+                if not data:
+                    # The file was truncated. Keep the promised size.
+                    data = b'\0' * min(buffer_size, remaining)
+                remaining -= len(data)
+                data = encode(data)
+                if data:
+                    yield data
+        padding = -tarinfo.size % tarfile.BLOCKSIZE
+        written += tarinfo.size + padding
+        yield encode(b'\0' * padding)
+    trailer = b'\0' * (tarfile.BLOCKSIZE * 2)
+    trailer += b'\0' * (-(written + len(trailer)) % tarfile.RECORDSIZE)
+    yield encode(trailer)
+    if compress:
+        yield compressor.flush()
+
+
+def archive_format(name):
+    """Returns ``'zip'`` or ``'tar'`` if a file named `name` is an archive
+    which can be browsed, or ``None``.
+    """
+    name = name.lower()
+    for ext, format in BROWSE_EXTENSIONS:
+        if name.endswith(ext):
+            return format
+    return None
+
+
+def archive_index(path, stat=None):
+    """Returns the :class:`ArchiveIndex` of the archive at `path`. It is
+    cached until the mtime or the size of the archive changes. Raises
+    :exc:`ValueError` if the archive can't be read.
+
+    :param stat: the stat of the archive if the caller already has one.
+    """
+    if stat is None:
+        stat = os.stat(path)
+    fingerprint = ListingCache.fingerprint(stat) + (stat.st_size,)
+    cached = _indexes.get(path)
+    if cached is not None and cached[0] == fingerprint:
+        return cached[1]
+    format = archive_format(path)
+    if format is None:
+        raise ValueError('{0} is not an archive'.format(path))
+    try:
+        index = ArchiveIndex(path, format, stat)
+    except (OSError, EOFError, tarfile.TarError, zipfile.BadZipFile) as exc:
+        raise ValueError('{0} is broken: {1}'.format(path, exc))
+    _indexes.set(path, (fingerprint, index))
+    return index
+
+
+class _MemberFile(object):
+    """A file in a tar archive which closes the archive with itself."""
+
+    def __init__(self, f, tar):
+        self._f = f
+        self._tar = tar
+
+    def read(self, size=-1):
+        return self._f.read(size)
+
+    def close(self):
+        self._f.close()
+        self._tar.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+class ArchiveIndex(object):
+    """The members of a zip or tar archive. The central directory of a zip
+    archive or the headers of a tar archive are read only once, and members
+    are opened right where they are later. Members of a compressed tar
+    archive are reached by decompressing the archive up to them while they
+    are read.
+
+    :param path: the path of the archive.
+    :param format: ``'zip'`` or ``'tar'``.
+    :param stat: the stat of the archive.
+    """
+
+    def __init__(self, path, format, stat):
+        self.path = path
+        self.format = format
+        self.stat = stat
+        #: The stat and the zip or tar info of each member by its path.
+        #: Directories which only exist in the paths of other members have
+        #: no info.
+        self.members = {}
+        #: The names of the children of each directory. The top is ``''``.
+        self.children = {'': set()}
+        #: Whether it is a tar archive compressed as a whole.
+        self.compressed = False
+        self._inodes = 0
+        if format == 'zip':
+            self._zip = zipfile.ZipFile(path)
+            for zinfo in self._zip.infolist():
+                mtime = time.mktime(zinfo.date_time + (0, 0, -1))
+                self._add(zinfo.filename, zinfo.is_dir(), zinfo.file_size,
+                          mtime, zinfo.external_attr >> 16, zinfo)
+        else:
+            self._zip = None
+            with open(path, 'rb') as f:
+                self.compressed = f.read(6).startswith(COMPRESSED_MAGIC)
+            with tarfile.open(path) as tar:
+                for tarinfo in tar:
+                    if tarinfo.isdir() or tarinfo.isreg():
+                        self._add(tarinfo.name, tarinfo.isdir(),
+                                  tarinfo.size, tarinfo.mtime, tarinfo.mode,
+                                  tarinfo)
+
+    def _add(self, name, isdir, size, mtime, mode, info):
+        parts = [part for part in name.split('/') if part not in ('', '.')]
+        if not parts or '..' in parts:
+            return  # never leave the archive
+        for depth, part in enumerate(parts):
+            self.children['/'.join(parts[:depth])].add(part)
+            member = '/'.join(parts[:depth + 1])
+            if depth < len(parts) - 1 and member not in self.children:
+                self.children[member] = set()
+                if member not in self.members:
+                    self.members[member] = (self._stat(True, 0,
+                                            self.stat.st_mtime, 0), None)
+        if isdir:
+            self.children.setdefault(member, set())
+            size = 0
+        self.members[member] = (self._stat(isdir, size, mtime, mode), info)
+
+    def _stat(self, isdir, size, mtime, mode):
+        """Makes a stat of a member. Each member gets its own inode number so
+        that walks tell directories apart.
+        """
+        if isdir:
+            mode = S_IFDIR | (mode & 0o7777 or 0o755)
+        else:
+            mode = S_IFREG | (mode & 0o7777 or 0o644)
+        self._inodes += 1
+        return os.stat_result((mode, self._inodes, 0, 1, 0, 0, size, mtime,
+                               mtime, mtime))
+
+    def open(self, member):
+        """Opens a file member for reading. Raises :exc:`IOError` if it can't
+        be extracted, for example because it is encrypted.
+        """
+        info = self.members[member][1]
+        try:
+            if self._zip is not None:
+                return self._zip.open(info)
+            # Seeking in a compressed tar archive decompresses and drops
+            # everything before the member. It happens on the first read, so
+            # the response starts at once.
+            tar = tarfile.open(self.path, 'r:*' if self.compressed else 'r:')
+            try:
+                return _MemberFile(tar.extractfile(info), tar)
+            except BaseException:
+                tar.close()
+                raise
+        except (RuntimeError, NotImplementedError, EOFError,
+                tarfile.TarError, zipfile.BadZipFile) as exc:
+            raise IOError('{0} can\'t be extracted: {1}'.format(member, exc))
+
+
+class _ArchiveEntry(object):
+    """The common part of entries in an archive. They are not registered in
+    the root directory, and their stats come from the archive index.
+    """
+
+    def _init_member(self, archive, member, index):
+        self.archive = archive
+        self.member = member
+        self.index = index or archive_index(archive.abspath, archive.stat)
+        self.rootdir = archive.rootdir
+        self.autoindex = archive.autoindex
+        self.path = archive.path + '/' + member
+        self.abspath = os.path.join(archive.abspath, *member.split('/'))
+        self.name = posixpath.basename(member) or archive.name
+        self.hidden = bool(self.HIDDEN.match(self.name))
+
+    def refresh(self):
+        return self
+
+    def invalidate(self):
+        pass
+
+    @property
+    def parent(self):
+        if not self.member:
+            return self.archive.parent
+        return ArchiveDirectory(self.archive, posixpath.dirname(self.member),
+                                self.index)
+
+
+class ArchiveDirectory(_ArchiveEntry, Directory):
+    """This class wraps a zip or tar archive, or a directory in it, as a
+    directory. Its children come from the :class:`ArchiveIndex`, so it is
+    listed like other directories. The top of an archive has the path of the
+    archive followed by ``/``.
+
+    :param archive: the :class:`File` of the archive.
+    :param member: the path of the directory in the archive. The top is
+                   ``''``.
+    :param index: the :class:`ArchiveIndex` if the caller already has one.
+    """
+
+    def __new__(cls, *args, **kwargs):
+        return object.__new__(cls)
+
+    def __init__(self, archive, member='', index=None):
+        self._init_member(archive, member, index)
+        if member:
+            self._stat = self.index.members[member][0]
+        else:
+            self._stat = archive.stat
+
+    @property
+    def parent_entry(self):
+        return _ArchiveParentDirectory(self)
+
+    def _scan(self, rootdir):
+        """Yields the child entries from the archive index."""
+        for name in self.index.children[self.member]:
+            yield self.get_child(name)
+
+    def get_child(self, childname):
+        """Returns a child file or directory in the archive."""
+        member = self.member + '/' + childname if self.member else childname
+        try:
+            stat = self.index.members[member][0]
+        except KeyError:
+            raise IOError('{0} does not exist'.format(childname))
+        if S_ISDIR(stat.st_mode):
+            return ArchiveDirectory(self.archive, member, self.index)
+        return ArchiveFile(self.archive, member, self.index)
+
+    def __contains__(self, path_or_entry):
+        if isinstance(path_or_entry, Entry):
+            prefix = self.path.rstrip('/') + '/'
+            if not path_or_entry.path.startswith(prefix):
+                return False
+            path = path_or_entry.path[len(prefix):]
+        else:
+            path = path_or_entry
+        member = posixpath.normpath(posixpath.join(self.member, path))
+        return member in self.index.members
+
+
+class ArchiveFile(_ArchiveEntry, File):
+    """This class wraps a file in a zip or tar archive.
+
+    :param archive: the :class:`File` of the archive.
+    :param member: the path of the file in the archive.
+    :param index: the :class:`ArchiveIndex` if the caller already has one.
+    """
+
+    #: Archives in archives can't be browsed.
+    browsable = False
+
+    def __new__(cls, *args, **kwargs):
+        return object.__new__(cls)
+
+    def __init__(self, archive, member, index=None):
+        self._init_member(archive, member, index)
+        try:
+            self.ext = re.search(self.EXTENSION, self.name).group(1)
+        except AttributeError:
+            self.ext = None
+        self._stat = self.index.members[member][0]
+
+    @property
+    def mimetype(self):
+        """A mimetype of this file guessed by its name. The content is never
+        sniffed, because it would have to be extracted.
+        """
+        return guess_type(self.name)
+
+    @property
+    def data(self):
+        with self.open() as f:
+            return f.read().decode('utf-8')
+
+    def open(self):
+        """Opens this file in the archive for reading."""
+        return self.index.open(self.member)
+
+
+class _ArchiveParentDirectory(_ParentDirectory):
+    """This class wraps the parent of a directory in an archive."""
+
+    def __new__(cls, child_directory):
+        return object.__new__(cls)
+
+    def __init__(self, child_directory):
+        parent = child_directory.parent
+        self.rootdir = parent.rootdir
+        self.autoindex = parent.autoindex
+        self.path = parent.path
+        self.abspath = parent.abspath
+        self.name = '..'
+        self.hidden = False
+        self._stat = parent.stat
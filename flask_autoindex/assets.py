@@ -0,0 +1,187 @@
+# -*- coding: utf-8 -*-
+import hashlib
+import os
+
+import flask_silk
+from flask import Response, abort, request
+
+from .cache import LRUCache
+from .compress import available_encodings, compress, negotiate
+from .mimetype import guess_type
+
+
+#: The directory of the silk icons which :mod:`flask_silk` prepares.
+SILK_ICONS = os.path.join(os.path.dirname(flask_silk.__file__), 'icons')
+
+#: Seconds to cache an asset whose url has its version.
+IMMUTABLE_MAX_AGE = 365 * 24 * 60 * 60
+
+
+class Asset(object):
+    """A small file which is kept in memory with its version and compressed
+    variants.
+
+    :param path: the path of the file.
+    """
+
+    def __init__(self, path):
+        with open(path, 'rb') as f:
+            self.data = f.read()
+        self.mtime = int(os.stat(path).st_mtime)
+        self.mimetype = guess_type(path)[0] or 'application/octet-stream'
+        #: A hash of the content. Urls with it never go stale.
+        self.version = hashlib.sha1(self.data).hexdigest()[:12]
+        self.variants = {}
+        if not self.mimetype.startswith('image/'):
+            for encoding in available_encodings():
+                compressed = compress(self.data, encoding, 9)
+                if len(compressed) < len(self.data):
+                    self.variants[encoding] = compressed
+
+    def send(self, version=None):
+        """Sends the asset. It is cached for a year if `version`, or ``?v=``
+        of the request by default, is the current version, so pages which
+        link it with the version don't request it again.
+        """
+        if version is None:
+            version = request.args.get('v')
+        encoding = negotiate(request.accept_encodings, list(self.variants))
+        if encoding is None:
+            response = Response(self.data, mimetype=self.mimetype)
+            response.set_etag(self.version)
+        else:
+            response = Response(self.variants[encoding],
+                                mimetype=self.mimetype)
+            response.content_encoding = encoding
+            response.set_etag('{0}-{1}'.format(self.version, encoding))
+        if self.variants:
+            response.vary.add('Accept-Encoding')
+        response.last_modified = self.mtime
+        set_cache_control(response, version == self.version)
+        return response.make_conditional(request)
+
+
+def load_assets(folder):
+    """Loads every file under `folder` as an :class:`Asset`. Returns a dict
+    of them by their paths relative to `folder` with ``/`` separators.
+    """
+    assets = {}
+    for dirpath, dirnames, filenames in os.walk(folder):
+        for filename in filenames:
+            path = os.path.join(dirpath, filename)
+            relpath = os.path.relpath(path, folder).replace(os.path.sep, '/')
+            assets[relpath] = Asset(path)
+    return assets
+
+
+def send_asset(assets, filename):
+    """Sends an asset from a dict which :func:`load_assets` made."""
+    try:
+        asset = assets[filename]
+    except KeyError:
+        return abort(404)
+    return asset.send()
+
+
+def set_cache_control(response, immutable):
+    """Lets a response be cached for a year if `immutable`, or revalidated
+    on each use otherwise.
+    """
+    if immutable:
+        response.cache_control.no_cache = None
+        response.cache_control.public = True
+        response.cache_control.max_age = IMMUTABLE_MAX_AGE
+        response.cache_control.immutable = True
+    else:
+        response.cache_control.no_cache = True
+
+
+class IconTable(object):
+    """Finds icons by their names in a table which is built by listing the
+    icon directories once, and keeps the icons in memory. The table is built
+    again when the list of directories changes.
+
+    :param directories: the list of directories to find icons in before the
+                        silk icons. Earlier directories come first.
+    :param maxweight: the maximum bytes of icons to keep in memory.
+    """
+
+    def __init__(self, directories, maxweight=8 * 1024 * 1024):
+        self.directories = directories
+        self._key = None
+        self._paths = {}
+        self._assets = LRUCache(maxsize=None, maxweight=maxweight,
+                                weigh=lambda asset: len(asset.data))
+
+    def _table(self):
+        key = tuple(self.directories)
+        if key == self._key:
+            return self._paths
+        paths = {}
+        for directory in [SILK_ICONS] + list(reversed(key)):
+            try:
+                with os.scandir(directory) as dirents:
+                    for dirent in dirents:
+                        if dirent.is_file():
+                            paths[dirent.name] = dirent.path
+            except OSError:
+                continue
+        self._paths = paths
+        self._assets.clear()
+        self._key = key
+        return paths
+
+    def find(self, icon):
+        """Returns the path of an icon, or ``None`` if there's no such
+        icon.
+        """
+        return self._table().get(icon)
+
+    def get(self, icon):
+        """Returns an icon as an :class:`Asset`, or ``None`` if there's no
+        such icon.
+        """
+        path = self.find(icon)
+        if path is None:
+            return None
+        asset = self._assets.get(path)
+        if asset is None:
+            try:
+                asset = Asset(path)
+            except OSError:
+                return None
+            self._assets.set(path, asset)
+        return asset
+
+    def version(self, icon):
+        """Returns a hash of the content of an icon, or ``None``."""
+        asset = self.get(icon)
+        return asset and asset.version
+
+    def send(self, icon, version=None):
+        """Sends an icon. See :meth:`Asset.send`."""
+        asset = self.get(icon)
+        if asset is None:
+            return abort(404)
+        return asset.send(version)
+
+
+class CachedSilk(flask_silk.Silk):
+    """:class:`flask_silk.Silk` which serves icons from an
+    :class:`IconTable` instead of trying each directory.
+
+    :param base: the flask application or blueprint.
+    :param icon_table: the :class:`IconTable`.
+    :param silk_path: the path to serve silk icons.
+    """
+
+    def __init__(self, base, icon_table, silk_path='/icons'):
+        self.icon_table = icon_table
+        super(CachedSilk, self).__init__(base, silk_path)
+
+    def silkicon(self, filename):
+        return self.icon_table.send(filename)
+
+
+#: The icons of :attr:`flask_silk.Silk.directories` which every silk shares.
+silk_icons = IconTable(flask_silk.Silk.directories)
@@ -0,0 +1,521 @@
+# -*- coding: utf-8 -*-
+import os
+import tempfile
+import threading
+import time
+import weakref
+from collections import OrderedDict
+
+from jinja2.bccache import Bucket, BytecodeCache, FileSystemBytecodeCache
+
+
+_missing = object()
+
+
+class LRUCache(object):
+    """A thread-safe mapping which keeps at most `maxsize` items and forgets
+    the least recently used item first. An item older than `ttl` seconds
+    expires.
+
+    :param maxsize: the maximum number of items. ``None`` means unbounded.
+    :param ttl: seconds until an item expires. ``None`` means never.
+    :param maxweight: the maximum total weight of items. ``None`` means
+                      unbounded.
+    :param weigh: a function which returns the weight of a value. By default,
+                  every value weighs ``1``.
+    """
+
+    def __init__(self, maxsize=1024, ttl=None, maxweight=None, weigh=None):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.maxweight = maxweight
+        self.weigh = weigh or (lambda value: 1)
+        self.weight = 0
+        self.hits = self.misses = self.evictions = 0
+        self._items = OrderedDict()
+        self._lock = threading.RLock()
+
+    def _get(self, key):
+        try:
+            value, expires, weight = self._items[key]
+        except KeyError:
+            return _missing
+        if expires is not None and expires <= time.monotonic():
+            self._remove(key)
+            self.evictions += 1
+            return _missing
+        self._items.move_to_end(key)
+        return value
+
+    def _recover(self, key):
+        """Called when `key` is missing. It may return a value to cache
+        again.
+        """
+        return _missing
+
+    def _remove(self, key):
+        value, expires, weight = self._items.pop(key)
+        self.weight -= weight
+        return value
+
+    def _evict(self):
+        while self._items and (
+                self.maxsize is not None and len(self._items) > self.maxsize or
+                self.maxweight is not None and self.weight > self.maxweight):
+            self._remove(next(iter(self._items)))
+            self.evictions += 1
+
+    def get(self, key, default=None):
+        """Returns the value for `key`, or `default` if it is missing."""
+        with self._lock:
+            value = self._get(key)
+            if value is _missing:
+                value = self._recover(key)
+            if value is _missing:
+                self.misses += 1
+                return default
+            self.hits += 1
+            return value
+
+    def set(self, key, value):
+        """Caches `value` for `key` as the most recently used item."""
+        with self._lock:
+            if self.ttl is None:
+                expires = None
+            else:
+                expires = time.monotonic() + self.ttl
+            if key in self._items:
+                self._remove(key)
+            weight = self.weigh(value)
+            self._items[key] = (value, expires, weight)
+            self.weight += weight
+            self._evict()
+
+    def pop(self, key, default=None):
+        """Forgets `key` and returns its value."""
+        with self._lock:
+            try:
+                return self._remove(key)
+            except KeyError:
+                return default
+
+    def clear(self):
+        """Forgets every item."""
+        with self._lock:
+            self._items.clear()
+            self.weight = 0
+
+    def keys(self):
+        """Returns a list of the cached keys."""
+        with self._lock:
+            return list(self._items)
+
+    def stats(self):
+        """Returns a dict of the hit, miss and eviction counters."""
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {'hits': self.hits, 'misses': self.misses,
+                    'evictions': self.evictions, 'size': len(self._items),
+                    'weight': self.weight,
+                    'hit_ratio': self.hits / lookups if lookups else 0.0}
+
+    def __getitem__(self, key):
+        value = self.get(key, _missing)
+        if value is _missing:
+            raise KeyError(key)
+        return value
+
+    def __setitem__(self, key, value):
+        self.set(key, value)
+
+    def __delitem__(self, key):
+        with self._lock:
+            self._remove(key)
+
+    def __contains__(self, key):
+        with self._lock:
+            return key in self._items
+
+    def __len__(self):
+        return len(self._items)
+
+
+class WeakLRUCache(LRUCache):
+    """An :class:`LRUCache` which also remembers its values by weak reference.
+    A value which is still alive somewhere else is never forgotten, even after
+    it was evicted or expired, so it keeps its identity.
+    """
+
+    def __init__(self, maxsize=1024, ttl=None):
+        super(WeakLRUCache, self).__init__(maxsize, ttl)
+        self._refs = weakref.WeakValueDictionary()
+
+    def _recover(self, key):
+        value = self._refs.get(key, _missing)
+        if value is not _missing:
+            self.set(key, value)
+        return value
+
+    def set(self, key, value):
+        with self._lock:
+            self._refs[key] = value
+            super(WeakLRUCache, self).set(key, value)
+
+    def pop(self, key, default=None):
+        with self._lock:
+            self._refs.pop(key, None)
+            return super(WeakLRUCache, self).pop(key, default)
+
+    def clear(self):
+        with self._lock:
+            self._refs.clear()
+            super(WeakLRUCache, self).clear()
+
+    def __delitem__(self, key):
+        with self._lock:
+            self._refs.pop(key, None)
+            super(WeakLRUCache, self).__delitem__(key)
+
+
+class _ListingLRUCache(LRUCache):
+    """An :class:`LRUCache` of listings which remembers the directories of
+    removed listings until :meth:`ListingCache._release` looks at them.
+    """
+
+    def __init__(self, *args, **kwargs):
+        super(_ListingLRUCache, self).__init__(*args, **kwargs)
+        self.removed = set()
+
+    def _remove(self, key):
+        value = super(_ListingLRUCache, self)._remove(key)
+        self.removed.add(key[:2])
+        return value
+
+    def clear(self):
+        with self._lock:
+            self.removed.update(key[:2] for key in self._items)
+            super(_ListingLRUCache, self).clear()
+
+    def pop_removed(self):
+        """Returns the remembered directories and forgets them."""
+        with self._lock:
+            removed, self.removed = self.removed, set()
+            return removed
+
+
+class ListingCache(object):
+    """Caches the sorted entries of explored directories. A cached listing is
+    used while the mtime and ctime of its directory stay the same, so a hit
+    costs a single stat of the directory.
+
+    Files changed in place don't touch the mtime of their directory. Their
+    cached stat snapshots stay as they were until the directory changes,
+    unless `watch` is ``True``.
+
+    With `watch`, listed directories are watched by a
+    :class:`~flask_autoindex.watch.Watcher` (inotify on Linux, polling
+    elsewhere). A change drops the listings and the stat snapshots of the
+    directory as soon as it happens, and a hit costs no stat at all. A
+    directory is not watched anymore when its last listing is dropped.
+
+    :param maxsize: the maximum number of cached listings.
+    :param maxentries: the maximum number of entries in all cached listings.
+    :param ttl: seconds until a cached listing expires. ``None`` means never.
+    :param watch: whether to invalidate listings by watching directories.
+    :param maxwatches: the maximum number of watched directories. Listings
+                       of the other directories are validated by stat.
+    """
+
+    def __init__(self, maxsize=256, maxentries=100000, ttl=None, watch=False,
+                 maxwatches=100000):
+        self._listings = _ListingLRUCache(
+            maxsize, ttl, maxweight=maxentries,
+            weigh=lambda listing: len(listing[1]))
+        self.hits = self.misses = 0
+        if watch:
+            from .watch import make_watcher
+            self.watcher = make_watcher(self._changed, maxwatches)
+        else:
+            self.watcher = None
+        # A new token for a directory each time it changes. A listing which
+        # was scanned while its directory changed is not cached.
+        self._generations = LRUCache(maxwatches)
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def fingerprint(stat):
+        """Returns what identifies a version of a directory from its stat."""
+        return (stat.st_dev, stat.st_ino, stat.st_mtime_ns, stat.st_ctime_ns)
+
+    def explore(self, directory, sort_by='name', order=1, show_hidden=False,
+                stat=None):
+        """Returns the list of entries :meth:`Directory.explore` yields.
+
+        :param stat: the stat of `directory` if the caller already has one.
+        """
+        entries, total = self.sort_children(directory, sort_by, order,
+                                            show_hidden, stat)
+        if not directory.is_root():
+            entries = [directory.parent_entry] + entries
+        return entries
+
+    def sort_children(self, directory, sort_by='name', order=1,
+                      show_hidden=False, stat=None, limit=None):
+        """Returns what :meth:`Directory.sort_children` returns. A listing
+        which was cached by a partial sort is used while it has at least
+        `limit` entries.
+
+        :param stat: the stat of `directory` if the caller already has one.
+        """
+        path = os.path.normpath(directory.abspath)
+        generation = self._generation(path)
+        if self.watcher is not None and self.watcher.watch(path):
+            fingerprint = None
+        else:
+            if stat is None:
+                stat = os.stat(directory.abspath)
+            fingerprint = self.fingerprint(stat)
+        key = (directory.rootdir, directory.path, show_hidden, sort_by, order)
+        listing = self._listings.get(key)
+        self._release()
+        if listing is not None and listing[0] == fingerprint:
+            entries, total = listing[1:]
+            if len(entries) == total or \
+               limit is not None and len(entries) >= limit:
+                self.hits += 1
+                return (entries, total)
+        self.misses += 1
+        entries, total = directory.sort_children(sort_by, order, show_hidden,
+                                                 limit)
+        with self._lock:
+            if fingerprint is not None or \
+               self._generations.get(path) is generation:
+                self._listings.set(key, (fingerprint, entries, total))
+        self._release()
+        return (entries, total)
+
+    def _generation(self, path):
+        """Returns the current generation token of a directory."""
+        generation = self._generations.get(path)
+        if generation is None:
+            generation = object()
+            self._generations.set(path, generation)
+        return generation
+
+    def invalidate(self, directory=None):
+        """Forgets the listings of `directory`, or every listing."""
+        if directory is None:
+            self._listings.clear()
+        else:
+            for key in self._listings.keys():
+                if key[:2] == (directory.rootdir, directory.path):
+                    self._listings.pop(key)
+        self._release()
+
+    def _release(self):
+        """Stops watching the directories whose last listings were removed.
+        The generation of such a directory changes, so a listing which is
+        being scanned meanwhile is not cached without a watch.
+        """
+        removed = self._listings.pop_removed()
+        if self.watcher is None or not removed:
+            return
+        with self._lock:
+            removed -= set(key[:2] for key in self._listings.keys())
+            for rootdir, dirpath in removed:
+                path = os.path.normpath(os.path.join(rootdir.abspath,
+                                                     dirpath))
+                self.watcher.unwatch(path)
+                self._generations.set(path, object())
+
+    def _changed(self, path, name=None):
+        """Called by the watcher when the directory at `path` changed."""
+        path = os.path.normpath(path)
+        with self._lock:
+            self._generations.set(path, object())
+        for key in self._listings.keys():
+            rootdir, dirpath = key[:2]
+            if os.path.normpath(os.path.join(rootdir.abspath, dirpath)) != path:
+                continue
+            listing = self._listings.pop(key)
+            for ent in listing[1] if listing else ():
+                if name is None or ent.name == name:
+                    ent.invalidate()
+        self._release()
+
+    def stats(self):
+        """Returns a dict of the hit, miss and eviction counters. A listing
+        of a changed directory counts as a miss.
+        """
+        stats = self._listings.stats()
+        lookups = self.hits + self.misses
+        stats.update(hits=self.hits, misses=self.misses,
+                     hit_ratio=self.hits / lookups if lookups else 0.0)
+        return stats
+
+
+class PageCache(object):
+    """The interface of rendered page caches. A page cache maps string keys
+    to bytes. Keys identify the version of a listing, so a cached page never
+    goes stale and backends may forget pages whenever they like.
+    """
+
+    def get(self, key):
+        """Returns the bytes for `key`, or ``None`` if it is missing."""
+        raise NotImplementedError()
+
+    def set(self, key, value):
+        """Stores the bytes for `key`."""
+        raise NotImplementedError()
+
+    def clear(self):
+        """Forgets every page."""
+        raise NotImplementedError()
+
+
+class MemoryPageCache(PageCache):
+    """A :class:`PageCache` in the memory of the process.
+
+    :param maxbytes: the maximum total size of cached pages.
+    :param ttl: seconds until a page expires. ``None`` means never.
+    """
+
+    def __init__(self, maxbytes=64 * 1024 * 1024, ttl=None):
+        self._pages = LRUCache(None, ttl, maxweight=maxbytes, weigh=len)
+
+    def get(self, key):
+        return self._pages.get(key)
+
+    def set(self, key, value):
+        self._pages.set(key, value)
+
+    def clear(self):
+        self._pages.clear()
+
+    def stats(self):
+        """Returns a dict of the hit, miss and eviction counters."""
+        return self._pages.stats()
+
+
+class FileSystemPageCache(PageCache):
+    """A :class:`PageCache` in a directory, which processes can share. Each
+    page is written to a temporary file and renamed into place, so readers
+    never see a partial page.
+
+    :param path: the directory to store pages in. It is created if missing.
+    :param threshold: the maximum number of pages. When there are as many,
+                      the least recently written pages are removed until
+                      three quarters of them are left. Pages are counted on
+                      writes, so the directory is only listed then.
+    """
+
+    suffix = '.page'
+
+    def __init__(self, path, threshold=1000):
+        self.path = path
+        self.threshold = threshold
+        os.makedirs(path, exist_ok=True)
+        self._count = len(self._pages())
+
+    def _filename(self, key):
+        return os.path.join(self.path, key + self.suffix)
+
+    def get(self, key):
+        try:
+            with open(self._filename(key), 'rb') as f:
+                return f.read()
+        except OSError:
+            return None
+
+    def set(self, key, value):
+        if self._count >= self.threshold:
+            self._prune()
+        fd, tmp = tempfile.mkstemp(dir=self.path)
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                f.write(value)
+            os.replace(tmp, self._filename(key))
+            self._count += 1
+        except OSError:
+            try:
+                os.remove(tmp)
+            except OSError:
+                pass
+
+    def _pages(self):
+        with os.scandir(self.path) as dirents:
+            return [dirent for dirent in dirents
+                    if dirent.name.endswith(self.suffix)]
+
+    def _prune(self):
+        pages = self._pages()
+        self._count = len(pages)
+        if len(pages) < self.threshold:
+            return
+        def mtime(dirent):
+            try:
+                return dirent.stat().st_mtime
+            except OSError:
+                return 0  # removed by another process
+        pages.sort(key=mtime)
+        for dirent in pages[:len(pages) - self.threshold * 3 // 4]:
+            try:
+                os.remove(dirent.path)
+            except OSError:
+                pass
+            self._count -= 1
+
+    def clear(self):
+        for dirent in self._pages():
+            try:
+                os.remove(dirent.path)
+            except OSError:
+                pass
+        self._count = 0
+
+
+class TemplateBytecodeCache(BytecodeCache):
+    """A :class:`jinja2.BytecodeCache` which keeps the compiled templates
+    under a folder in another bytecode cache, and leaves the other templates
+    of the environment to the bytecode cache it had before.
+
+    :param cache: the bytecode cache, or a directory for a
+                  :class:`jinja2.FileSystemBytecodeCache`. It is created if
+                  missing. ``True`` means the default directory of Jinja2,
+                  which processes of the same user share.
+    :param folder: the folder of the templates to cache.
+    :param fallback: the bytecode cache for the other templates, or ``None``.
+    """
+
+    def __init__(self, cache, folder, fallback=None):
+        if cache is True:
+            cache = FileSystemBytecodeCache()
+        elif not isinstance(cache, BytecodeCache):
+            os.makedirs(cache, exist_ok=True)
+            cache = FileSystemBytecodeCache(cache)
+        self.cache = cache
+        self.folder = os.path.join(os.path.abspath(folder), '')
+        self.fallback = fallback
+
+    def _owner(self, filename):
+        if filename and os.path.abspath(filename).startswith(self.folder):
+            return self.cache
+        return self.fallback
+
+    def get_bucket(self, environment, name, filename, source):
+        owner = self._owner(filename)
+        if owner is None:
+            bucket = Bucket(environment, self.get_cache_key(name, filename),
+                            self.get_source_checksum(source))
+        else:
+            bucket = owner.get_bucket(environment, name, filename, source)
+        bucket.owner = owner
+        return bucket
+
+    def set_bucket(self, bucket):
+        owner = getattr(bucket, 'owner', None)
+        if owner is not None:
+            owner.set_bucket(bucket)
+
+    def clear(self):
+        self.cache.clear()
@@ -0,0 +1,96 @@
+# -*- coding: utf-8 -*-
+import gzip
+import os
+import zlib
+from stat import S_ISREG
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+
+#: The file extensions of pre-compressed sidecar files by content coding.
+SIDECAR_EXTENSIONS = {'br': '.br', 'gzip': '.gz'}
+
+
+def available_encodings():
+    """Returns the content codings which can be produced, best first. Brotli
+    needs the :mod:`brotli` module.
+    """
+    if brotli is None:
+        return ['gzip']
+    return ['br', 'gzip']
+
+
+def accepted_encodings(accept_encodings, encodings=None):
+    """Returns the content codings among `encodings` which the client
+    accepts, preferred first.
+
+    :param accept_encodings: the ``Accept-Encoding`` header as a
+                             :class:`werkzeug.datastructures.Accept`.
+    :param encodings: the candidates. By default, :func:`available_encodings`.
+    """
+    if encodings is None:
+        encodings = available_encodings()
+    encodings = [encoding for encoding in encodings
+                 if accept_encodings[encoding]]
+    encodings.sort(key=lambda encoding: -accept_encodings[encoding])
+    return encodings
+
+
+def negotiate(accept_encodings, encodings=None):
+    """Returns the content coding the client prefers among `encodings`, or
+    ``None`` if it accepts none of them. See :func:`accepted_encodings`.
+    """
+    encodings = accepted_encodings(accept_encodings, encodings)
+    return encodings[0] if encodings else None
+
+
+def compress(data, encoding, level=6):
+    """Compresses bytes with a content coding."""
+    if encoding == 'br':
+        return brotli.compress(data, quality=min(level, 11))
+    return gzip.compress(data, level)
+
+
+def compress_stream(chunks, encoding, level=6):
+    """Compresses strings from an iterable with a content coding. Each chunk
+    is flushed as soon as it is compressed, so a streamed body still goes out
+    progressively.
+    """
+    if encoding == 'br':
+        compressor = brotli.Compressor(quality=min(level, 11))
+        process, flush = compressor.process, compressor.flush
+        finish = compressor.finish
+    else:
+        compressor = zlib.compressobj(level, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+        process = compressor.compress
+        flush = lambda: compressor.flush(zlib.Z_SYNC_FLUSH)
+        finish = compressor.flush
+    for chunk in chunks:
+        if isinstance(chunk, str):
+            chunk = chunk.encode('utf-8')
+        data = process(chunk) + flush()
+        if data:
+            yield data
+    yield finish()
+
+
+def find_sidecar(path, stat, encodings):
+    """Finds a pre-compressed sidecar of a file, such as ``style.css.gz`` for
+    ``style.css``, with a content coding in `encodings`. A sidecar older than
+    the file or which is not a regular file is ignored. Returns a tuple of the path of the sidecar and the
+    content coding, or ``(None, None)``.
+    """
+    for encoding in encodings:
+        sidecar = path + SIDECAR_EXTENSIONS[encoding]
+        try:
+            sidecar_stat = os.stat(sidecar)
+        except OSError:
+            continue
+        if S_ISREG(sidecar_stat.st_mode) and \
+           sidecar_stat.st_mtime >= stat.st_mtime:
+            return (sidecar, encoding)
+    return (None, None)
+
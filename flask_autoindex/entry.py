@@ -1,24 +1,258 @@
 # -*- coding: utf-8 -*-
 from datetime import datetime
 from fnmatch import fnmatch
-from mimetypes import guess_type
-import functools
+from stat import S_ISDIR, S_ISREG
+import heapq
 import os
 import re
-import operator
 from urllib.parse import urljoin
-from flask import url_for, send_file
+from flask import (current_app, g, has_app_context, request, url_for,
+                   send_file)
+from werkzeug.routing import BuildError
 from werkzeug.utils import cached_property
 
+from .assets import silk_icons
+from .cache import WeakLRUCache
+from .mimetype import guess_type, sniff_type
+
 
 Default = None
+_missing = object()
+_GLOB = re.compile(r'[*?[]')
 
 
 is_same_path = lambda x, y: os.stat(x) == os.stat(y)
 
 
-def _make_mimetype_matcher(mimetype):
-    return lambda ent: fnmatch(guess_type(ent.name)[0] or '', mimetype)
+class _IconRule(object):
+    """An icon rule which :class:`_IconIndex` can compile into a dispatch
+    table. It is still callable like a rule function.
+
+    :param kind: one of ``'ext'``, ``'name'``, ``'mimetype'`` or ``'class'``.
+    :param value: the extension, name, mimetype pattern or class to match.
+    :param cls: if it is given, only instances of it match.
+    """
+
+    def __init__(self, kind, value, cls=None):
+        self.kind = kind
+        self.value = value
+        self.cls = cls
+
+    def __call__(self, ent):
+        if self.cls is not None and not isinstance(ent, self.cls):
+            return False
+        elif self.kind == 'ext':
+            return getattr(ent, 'ext', _missing) == self.value
+        elif self.kind == 'name':
+            return ent.name == self.value
+        elif self.kind == 'mimetype':
+            return fnmatch(_mimetype_of(ent), self.value)
+        elif self.kind == 'class':
+            return isinstance(ent, self.value)
+        return False
+
+
+class _IconMap(list):
+    """A list of icon rules which counts its changes, so that an
+    :class:`_IconIndex` of it knows when to compile it again.
+    """
+
+    version = 0
+
+
+def _counting(name):
+    method = getattr(list, name)
+    def mutate(self, *args, **kwargs):
+        result = method(self, *args, **kwargs)
+        self.version += 1
+        return result
+    mutate.__name__ = name
+    return mutate
+
+
+for _name in ['__setitem__', '__delitem__', '__iadd__', '__imul__', 'append',
+              'extend', 'insert', 'pop', 'remove', 'clear', 'sort',
+              'reverse']:
+    setattr(_IconMap, _name, _counting(_name))
+del _name
+
+
+def _icon_map_key(icon_map):
+    """Returns what changes whenever `icon_map` changes. An icon map which
+    is a plain list is compared by its rules.
+    """
+    if isinstance(icon_map, _IconMap):
+        return (id(icon_map), icon_map.version)
+    return (id(icon_map), tuple(icon_map))
+
+
+def _indexable_class(value):
+    """Whether instances of `value` can be found by the MRO of their types.
+    Tuples of classes and classes which customize :func:`isinstance`, such
+    as ABCs, can't.
+    """
+    return isinstance(value, type) and \
+        type(value).__instancecheck__ is type.__instancecheck__
+
+
+class _IconIndex(object):
+    """Compiles an icon map into dictionaries by extension, name, mimetype
+    and class. Other rules are kept in order and only called while they were
+    registered earlier than the best match from the dictionaries, so the
+    first matching rule wins as if the icon map was walked one by one.
+    """
+
+    def __init__(self, icon_map):
+        self.icon_map = icon_map
+        self.key = _icon_map_key(icon_map)
+        self.ext = {}
+        self.name = {}
+        self.mimetype = {}
+        self.mimetype_prefix = {}
+        self.classes = {}
+        self.callables = []
+        for index, (icon, rule) in enumerate(icon_map):
+            table, key = self._locate(rule)
+            if table is None:
+                self.callables.append((index, icon, rule))
+                continue
+            cls = None if rule.kind == 'class' else rule.cls
+            table.setdefault(key, []).append((index, icon, cls))
+
+    def _locate(self, rule):
+        """Returns the table and the key for a rule, or ``(None, None)``."""
+        if not isinstance(rule, _IconRule):
+            return (None, None)
+        elif rule.kind == 'ext':
+            return (self.ext, rule.value)
+        elif rule.kind == 'name':
+            return (self.name, rule.value)
+        elif rule.kind == 'class' and _indexable_class(rule.value):
+            return (self.classes, rule.value)
+        elif rule.kind == 'mimetype' and not _GLOB.search(rule.value):
+            return (self.mimetype, rule.value)
+        elif rule.kind == 'mimetype' and rule.value.endswith('/*') and \
+             not _GLOB.search(rule.value[:-2]):
+            return (self.mimetype_prefix, rule.value[:-2])
+        return (None, None)
+
+    @classmethod
+    def of(cls, owner):
+        """Returns the index of ``owner.icon_map``. It is compiled again when
+        the icon map changed.
+        """
+        icon_map = getattr(owner, 'icon_map', None)
+        if icon_map is None:
+            return None
+        index = owner.__dict__.get('_icon_index')
+        if index is None or index.icon_map is not icon_map or \
+           index.key != _icon_map_key(icon_map):
+            index = cls(icon_map)
+            setattr(owner, '_icon_index', index)
+        return index
+
+    def lookup(self, ent):
+        """Returns the icon of the first matching rule, or ``None``."""
+        candidates = [self.ext.get(getattr(ent, 'ext', _missing)),
+                      self.name.get(ent.name)]
+        if self.mimetype or self.mimetype_prefix:
+            mimetype = _mimetype_of(ent)
+            candidates.append(self.mimetype.get(mimetype))
+            candidates.append(self.mimetype_prefix.get(
+                mimetype.split('/', 1)[0]))
+        if self.classes:
+            candidates.extend(self.classes.get(c) for c in type(ent).__mro__)
+        best = None
+        for rules in candidates:
+            for index, icon, cls in rules or ():
+                if best is not None and index > best[0]:
+                    break
+                if cls is None or isinstance(ent, cls):
+                    best = (index, icon)
+                    break
+        for index, icon, rule in self.callables:
+            if best is not None and index > best[0]:
+                break
+            try:
+                if not rule and callable(icon):
+                    matched = icon = icon(ent)
+                else:
+                    matched = rule(ent)
+            except AttributeError:
+                continue
+            if matched:
+                return icon
+        return best and best[1]
+
+
+#: The properties which entries can be sorted by.
+_sortable = ('name', 'modified', 'size')
+
+
+def _make_sort_key(sort_by, reverse=False):
+    """Makes a key function for :meth:`Directory.explore` which returns a
+    tuple of the directory flag, the `sort_by` properties and the name.
+    Unknown properties are ignored, and entries are sorted by name if none is
+    left. Entries without a property come before the others.
+    """
+    if isinstance(sort_by, str):
+        sort_by = sort_by.split(',')
+    sort_by = [attr for attr in sort_by if attr in _sortable] or ['name']
+    def key(ent):
+        # Keeps directories first even in descending order.
+        values = [isinstance(ent, File) is not reverse]
+        for attr in sort_by:
+            value = getattr(ent, attr, None)
+            values.append((value is not None, value))
+        values.append(ent.name)
+        return tuple(values)
+    return key
+
+
+def _mimetype_of(ent):
+    """Returns the mimetype of an entry for icon rules, or ``''``."""
+    mimetype = getattr(ent, 'mimetype', None)
+    if mimetype is None:
+        mimetype = guess_type(ent.name)
+    return mimetype[0] or ''
+
+
+def _icon_base_url():
+    """Returns the url of the silk icons for the current request and whether
+    the icons can be linked with their versions. It is built once per request
+    and blueprint.
+    """
+    bases = g.setdefault('_autoindex_icon_bases', {})
+    try:
+        return bases[request.blueprint]
+    except KeyError:
+        base = url_for('.silkicon', filename='')
+        try:
+            url_for('.versioned_silkicon', version='0', filename='0')
+        except BuildError:
+            versioned = False
+        else:
+            versioned = True
+        bases[request.blueprint] = (base, versioned)
+        return (base, versioned)
+
+
+def icon_url(icon):
+    """Returns the url of an icon which an icon rule names. Names of silk icons
+    are resolved against the silk icon route, and urls are kept. A silk icon
+    is linked with a hash of its content, such as ``/__icons__/0123456789ab/
+    folder.png``, so that browsers can keep it.
+    """
+    try:
+        base, versioned = _icon_base_url()
+    except RuntimeError:
+        return icon  # outside of a request context
+    if '/' in icon or ':' in icon:
+        return urljoin(base, icon)
+    version = versioned and silk_icons.version(icon)
+    if version:
+        return '{0}{1}/{2}'.format(base, version, icon)
+    return base + icon
 
 
 def _make_args_for_entry(args, kwargs):
@@ -48,7 +282,7 @@ class _EntryMeta(type):
         return ent
 
 
-class Entry(_EntryMeta):
+class Entry(metaclass=_EntryMeta):
     """This class wraps file or directory. It is an abstract class, but it
     returns a derived instance. You can make an instance such as::
 
@@ -60,10 +294,17 @@ class Entry(_EntryMeta):
 
     HIDDEN = re.compile('^\.')
 
+    #: The icon which is used when guessing an icon failed.
+    fallback_icon = 'page_white.png'
+
     def __new__(cls, *args, **kwargs):
         """Returns a file or directory instance."""
         path, rootdir, autoindex = _make_args_for_entry(args, kwargs)
         if rootdir:
+            try:
+                return rootdir._get_descendant(path, autoindex)
+            except KeyError:
+                pass
             abspath = os.path.join(rootdir.abspath, path)
         else:
             abspath = os.path.abspath(path)
@@ -99,14 +340,45 @@ class Entry(_EntryMeta):
     def parent(self):
         if self.is_root():
             return None
-        elif is_same_path(os.path.dirname(self.abspath), self.rootdir.abspath):
+        path = os.path.dirname(self.path)
+        if path in ('', os.path.curdir):
             return self.rootdir
-        return Entry(os.path.dirname(self.path), self.rootdir)
+        return Entry(path, self.rootdir)
+
+    @property
+    def stat(self):
+        """The :func:`os.stat` result of this. It is a snapshot taken when the
+        parent directory was explored, or on the first access otherwise. Call
+        :meth:`refresh` to take a new one.
+        """
+        try:
+            return self._stat
+        except AttributeError:
+            return self.refresh()._stat
+
+    def refresh(self):
+        """Takes a new stat snapshot of this and returns itself."""
+        self._stat = os.stat(self.abspath)
+        return self
+
+    def invalidate(self):
+        """Drops the stat snapshot of this. The next access takes a new one."""
+        self.__dict__.pop('_stat', None)
 
     @property
     def modified(self):
         """Returns modified time of this."""
-        return datetime.fromtimestamp(os.path.getmtime(self.abspath)).replace(microsecond=0)
+        return datetime.fromtimestamp(self.stat.st_mtime).replace(microsecond=0)
+
+    @property
+    def mode(self):
+        """The file mode of this."""
+        return self.stat.st_mode
+
+    @property
+    def inode(self):
+        """The inode number of this."""
+        return self.stat.st_ino
 
     @classmethod
     def add_icon_rule(cls, icon, rule=None):
@@ -116,42 +388,42 @@ class Entry(_EntryMeta):
     @classmethod
     def add_icon_rule_by_name(cls, icon, name):
         """Adds a new icon rule by the name globally."""
-        cls.add_icon_rule(icon, lambda ent: ent.name == name)
+        cls.add_icon_rule(icon, _IconRule('name', name, cls))
 
     @classmethod
     def add_icon_rule_by_class(cls, icon, _class):
         """Adds a new icon rule by the class globally."""
-        cls.add_icon_rule(icon, lambda ent: isinstance(ent, _class))
+        cls.add_icon_rule(icon, _IconRule('class', _class))
 
     def guess_icon(self):
-        """Guesses an icon from itself."""
-        def get_icon_url():
-            try:
-                if self.autoindex:
-                    icon_map = self.autoindex.icon_map + self.icon_map
-                else:
-                    icon_map = self.icon_map
-                for icon, rule in icon_map:
-                    if not rule and callable(icon):
-                        matched = icon = icon(self)
-                    else:
-                        matched = rule(self)
-                    if matched:
-                        return icon
-            except AttributeError:
-                pass
-            try:
-                return self.default_icon
-            except AttributeError:
-                raise GuessError('There is no matched icon.')
+        """Guesses an icon from itself. It returns the url of the icon."""
+        return icon_url(self.guess_icon_name())
+
+    def guess_icon_name(self):
+        """Guesses an icon from itself. It returns the icon as the rules name
+        it, such as ``'folder.png'``, before it is made an url.
+        """
+        try:
+            return self._guess_icon()
+        except Exception:
+            if has_app_context():
+                current_app.logger.exception('Failed to guess an icon for %s',
+                                             self.path)
+            return self.fallback_icon
+
+    def _guess_icon(self):
+        icon = None
+        if self.autoindex:
+            icon = _IconIndex.of(self.autoindex).lookup(self)
+        if not icon:
+            index = _IconIndex.of(type(self))
+            icon = index and index.lookup(self)
+        if icon:
+            return icon
         try:
-            print(url_for('.silkicon', filename=''))
-            return urljoin(url_for('.silkicon', filename=''), get_icon_url())
-        except (AttributeError, RuntimeError) as e:
-            print('""""""""""""')
-            print(e)
-            return 'ERROR'
-            return get_icon_url()
+            return self.default_icon
+        except AttributeError:
+            raise GuessError('There is no matched icon.')
 
 
 class File(Entry):
@@ -160,11 +432,11 @@ class File(Entry):
     EXTENSION = re.compile('\.([^.]+)$')
 
     default_icon = 'page_white.png'
-    icon_map = []
+    icon_map = _IconMap()
 
     def __new__(cls, path, rootdir=None, autoindex=None):
         try:
-            return rootdir._descendants[(path, autoindex)]
+            return rootdir._get_descendant(path, autoindex)
         except (AttributeError, KeyError):
             pass
         return object.__new__(cls)
@@ -182,32 +454,51 @@ class File(Entry):
         with open(self.abspath) as f:
             return ''.join(f.readlines())
 
-    @cached_property
+    def open(self):
+        """Opens this file for reading in binary mode."""
+        return open(self.abspath, 'rb')
+
+    @property
+    def browsable(self):
+        """Whether this file is an archive which the autoindex lets browse."""
+        if not getattr(self.autoindex, 'browse_archives', False):
+            return False
+        from .archive import archive_format
+        return archive_format(self.name) is not None
+
+    @property
     def mimetype(self):
-        """A mimetype of this file."""
-        return guess_type(self.abspath)
+        """A mimetype of this file. It is a tuple of the type and the encoding
+        like :func:`mimetypes.guess_type` returns. If the name doesn't tell
+        and the autoindex sniffs mimetypes, the content is sniffed.
+        """
+        guessed = guess_type(self.name)
+        if guessed[0] is None and \
+           getattr(self.autoindex, 'sniff_mimetypes', False):
+            guessed = sniff_type(self.abspath, self.stat)
+        return guessed
 
-    @cached_property
+    @property
     def size(self):
         """A size of this file."""
-        return os.path.getsize(self.abspath)
+        return self.stat.st_size
 
     @classmethod
     def add_icon_rule_by_ext(cls, icon, ext):
         """Adds a new icon rule by the file extension globally."""
-        cls.add_icon_rule(icon, lambda ent: ent.ext == ext)
+        cls.add_icon_rule(icon, _IconRule('ext', ext, cls))
 
     @classmethod
     def add_icon_rule_by_mimetype(cls, icon, mimetype):
         """Adds a new icon rule by the mimetype globally."""
-        cls.add_icon_rule(icon, _make_mimetype_matcher(mimetype))
+        cls.add_icon_rule(icon, _IconRule('mimetype', mimetype, cls))
 
 
 class Directory(Entry):
     """This class wraps a directory."""
 
     default_icon = 'folder.png'
-    icon_map = []
+    icon_map = _IconMap()
 
     def __new__(cls, *args, **kwargs):
         """If the path is same with root path, it returns a
@@ -216,8 +507,10 @@ class Directory(Entry):
         path, rootdir, autoindex = _make_args_for_entry(args, kwargs)
         if not rootdir:
             return RootDirectory(path, autoindex)
+        elif path == os.path.curdir:
+            return rootdir
         try:
-            return rootdir._descendants[(path, autoindex)]
+            return rootdir._get_descendant(path, autoindex)
         except KeyError:
             pass
         rootpath = rootdir.abspath
@@ -227,36 +520,159 @@ class Directory(Entry):
             return rootdir
         return object.__new__(cls)
 
-    def explore(self, sort_by='name', order=1, show_hidden=False):
-        """It is a generator. Each item is a child entry."""
+    def explore(self, sort_by='name', order=1, show_hidden=False,
+                limit=None):
+        """It is a generator. Each item is a child entry.
+
+        :param sort_by: the property to sort the entries by, one of
+                        ``'name'``, ``'modified'`` and ``'size'``. It can also
+                        be comma separated properties such as
+                        ``'size,name'``. Directories come first and names
+                        break ties.
+        :param order: ``1`` for ascending order or ``-1`` for descending.
+        :param show_hidden: whether to yield hidden entries.
+        :param limit: if it is given, only the first `limit` entries are
+                      yielded.
+        """
+        if not self.is_root():
+            yield self.parent_entry
+        entries, total = self.sort_children(sort_by, order, show_hidden, limit)
+        for ent in entries:
+            yield ent
+
+    def walk(self, depth=None, show_hidden=False, after=None, confine=False):
+        """Returns a generator which yields every descendant entry in
+        pre-order. Children of a directory are walked in the order of their
+        names, and a directory which is already being walked, such as a link
+        to an ancestor, is not walked again. Only the children of the
+        directories on the current path are kept in memory.
+
+        :param depth: the maximum depth to walk. ``1`` yields only the
+                      children. ``None`` means unlimited.
+        :param show_hidden: whether to yield and walk into hidden entries.
+        :param after: the :attr:`path` of an entry which was yielded last by
+                      an earlier walk. The walk resumes after it.
+        :param confine: if it is ``True``, symbolic links to somewhere out of
+                        the root directory are neither yielded nor walked.
+        """
+        if after:
+            prefix = '' if self.is_root() else self.path.rstrip('/') + '/'
+            if not after.startswith(prefix) or \
+               os.path.pardir in after.split('/'):
+                raise ValueError('{0} is not in {1}'.format(after, self.path))
+            cursor = after[len(prefix):].split('/')
+        else:
+            cursor = []
+        return self._walk(depth, show_hidden, cursor, confine)
+
+    def _walk(self, depth, show_hidden, cursor, confine):
+        rootdir = self if self.is_root() else self.rootdir
+        if confine:
+            root = os.path.join(os.path.realpath(rootdir.abspath), '')
+        def frame(directory, cursor):
+            entries = [ent for ent in directory._scan(rootdir)
+                       if not ent.is_root() and (show_hidden or not ent.hidden)
+                       and (not cursor or ent.name >= cursor[0])]
+            entries.sort(key=lambda ent: ent.name)
+            return [iter(entries), cursor]
+        if depth is not None and depth < 1:
+            return
+        stack = [frame(self, cursor)]
+        walking = [(self.stat.st_dev, self.stat.st_ino)]
+        while stack:
+            top = stack[-1]
+            ent = next(top[0], None)
+            if ent is None:
+                stack.pop()
+                walking.pop()
+                continue
+            if confine and os.path.islink(ent.abspath) and \
+               not os.path.join(os.path.realpath(ent.abspath),
+                                '').startswith(root):
+                continue
+            if top[1] and ent.name == top[1][0]:
+                # It was yielded before the cursor, but its descendants may
+                # not have been.
+                cursor = top[1][1:]
+            else:
+                cursor = []
+                yield ent
+            top[1] = []
+            if not isinstance(ent, Directory) or \
+               depth is not None and len(stack) >= depth:
+                continue
+            key = (ent.stat.st_dev, ent.stat.st_ino)
+            if key in walking:
+                continue
+            try:
+                stack.append(frame(ent, cursor))
+            except OSError:
+                continue  # ignore unreadable directories
+            walking.append(key)
 
-        def compare(ent1, ent2):
-            def asc():
-                if sort_by != 'modified' and type(ent1) is not type(ent2):
-                    return 1 if type(ent1) is File else -1
-                else:
-                    try:
-                        return operator.eq(getattr(ent1, sort_by),
-                                   getattr(ent2, sort_by))
-                    except AttributeError:
-                        return operator.eq(getattr(ent1, 'name'),
-                                   getattr(ent2, 'name'))
-            return asc() * order
+    @property
+    def parent_entry(self):
+        """The entry which links to the parent directory in a listing."""
+        return _ParentDirectory(self)
+
+    def sort_children(self, sort_by='name', order=1, show_hidden=False,
+                      limit=None):
+        """Returns a tuple of the sorted child entries and the number of all
+        of them. If `limit` is given, only the first `limit` entries are
+        picked by a partial sort on a heap and returned. See :meth:`explore`
+        for the other parameters.
+        """
         if not self.is_root():
-            yield _ParentDirectory(self)
             rootdir = self.rootdir
         else:
             rootdir = self
-        dirlist = os.listdir(self.abspath)
-        entries = []
-        for name in dirlist:
-            try:
-                entries.append(Entry(os.path.join(self.path, name).replace(os.path.sep, '/'), rootdir))
-            except IOError:
-                continue  # ignore stuff like broken links
-        entries = sorted(entries, key=functools.cmp_to_key(compare))
-        for ent in entries:
-            if show_hidden or not ent.hidden:
+        entries = [ent for ent in self._scan(rootdir)
+                   if show_hidden or not ent.hidden]
+        reverse = order < 0
+        key = _make_sort_key(sort_by, reverse)
+        total = len(entries)
+        if limit is not None and limit < total:
+            pick = heapq.nlargest if reverse else heapq.nsmallest
+            return (pick(limit, entries, key=key), total)
+        entries.sort(key=key, reverse=reverse)
+        return (entries, total)
+
+    def _scan(self, rootdir):
+        """Yields the child entries of this directory. The directory is read
+        once by :func:`os.scandir` and each child is built from its
+        :class:`os.DirEntry` with a single stat which becomes the
+        :attr:`Entry.stat` snapshot of the child.
+        """
+        rootstat = None
+        with os.scandir(self.abspath) as dirents:
+            for dirent in dirents:
+                if self.path == os.path.curdir:
+                    path = dirent.name
+                else:
+                    path = os.path.join(self.path, dirent.name)
+                    path = path.replace(os.path.sep, '/')
+                try:
+                    st = dirent.stat()
+                except OSError:
+                    continue  # ignore stuff like broken links
+                try:
+                    ent = rootdir._get_descendant(path)
+                except KeyError:
+                    if S_ISDIR(st.st_mode):
+                        # A link to the root directory is the root itself.
+                        if dirent.is_symlink():
+                            if rootstat is None:
+                                rootstat = os.stat(rootdir.abspath)
+                            if os.path.samestat(st, rootstat):
+                                yield rootdir
+                                continue
+                        ent = object.__new__(Directory)
+                    elif S_ISREG(st.st_mode):
+                        ent = object.__new__(File)
+                    else:
+                        continue
+                    ent.__init__(path, rootdir)
+                ent._stat = st
                 yield ent
 
     def get_child(self, childname):
@@ -290,38 +706,72 @@ class RootDirectory(Directory):
     """This class wraps a root directory."""
 
     default_icon = 'server.png'
-    icon_map = []
-    _rootdirs = {}
+    icon_map = _IconMap()
+
+    #: The number of descendants which a root directory keeps alive. Live
+    #: descendants are found by weak reference after they were evicted.
+    descendants_maxsize = 10000
+    #: Seconds until a kept descendant expires. ``None`` means never.
+    descendants_ttl = None
+
+    #: The root directories by the absolute path and the autoindex, for
+    #: an autoindex without its own :attr:`AutoIndex.rootdir_cache`.
+    _rootdirs = WeakLRUCache(maxsize=64)
 
     def __new__(cls, path, autoindex=None):
+        rootdirs = RootDirectory._registry(autoindex)
         try:
-            return RootDirectory._rootdirs[(path, autoindex)]
-        except KeyError as e:
-            print(e)
+            return rootdirs[(os.path.abspath(path), autoindex)]
+        except KeyError:
             return object.__new__(cls)
 
     def __init__(self, path, autoindex=None):
         super(RootDirectory, self).__init__('.', autoindex=autoindex)
         self.abspath = os.path.abspath(path)
         self.rootdir = self
-        self._descendants = {}
+        self._descendants = WeakLRUCache(self.descendants_maxsize,
+                                         self.descendants_ttl)
         RootDirectory._register_rootdir(self)
 
+    @classmethod
+    def _registry(cls, autoindex):
+        """Returns the cache which root directories of `autoindex` are
+        registered in.
+        """
+        rootdirs = getattr(autoindex, 'rootdir_cache', None)
+        if rootdirs is None:
+            return cls._rootdirs
+        return rootdirs
+
     @classmethod
     def _register_rootdir(cls, rootdir):
-        cls._rootdirs[(rootdir.abspath, rootdir.autoindex)] = rootdir
+        rootdirs = cls._registry(rootdir.autoindex)
+        rootdirs[(rootdir.abspath, rootdir.autoindex)] = rootdir
 
     def _register_descendant(self, entry):
         self._descendants[(entry.path, entry.autoindex)] = entry
 
+    def _get_descendant(self, path, autoindex=None):
+        """Returns a registered descendant or raises :exc:`KeyError`."""
+        return self._descendants[(path, autoindex or self.autoindex)]
+
 
 class _ParentDirectory(Directory):
     """This class wraps a parent directory."""
 
     default_icon = 'arrow_turn_up.png'
-    icon_map = []
+    icon_map = _IconMap()
 
-    def __new__(cls, *args, **kwargs):
+    def __new__(cls, child_directory):
+        path = os.path.join(child_directory.path, '..')
+        path = path.replace(os.path.sep, '/')
+        try:
+            ent = child_directory.rootdir._get_descendant(path)
+        except KeyError:
+            pass
+        else:
+            if type(ent) is cls:
+                return ent
         return object.__new__(cls)
 
     def __init__(self, child_directory):
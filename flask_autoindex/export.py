@@ -0,0 +1,69 @@
+# -*- coding: utf-8 -*-
+import csv
+import io
+import json
+
+from .entry import Directory
+
+
+#: The fields of a record in the order of CSV columns.
+FIELDS = ('name', 'path', 'type', 'size', 'mtime', 'icon')
+
+#: The mimetypes of export formats.
+EXPORT_MIMETYPES = {'ndjson': 'application/x-ndjson', 'csv': 'text/csv'}
+
+
+def entry_record(ent):
+    """Returns a dict of the data of an entry which machine-readable listings
+    consist of.
+    """
+    if isinstance(ent, Directory):
+        type_, size = 'directory', None
+    else:
+        type_, size = 'file', ent.size
+    return {'name': ent.name, 'path': ent.path, 'type': type_, 'size': size,
+            'mtime': ent.stat.st_mtime, 'icon': ent.guess_icon()}
+
+
+def generate_json(directory, entries, total, pagination=None):
+    """Yields a JSON document of a listing piece by piece, so that a huge
+    listing doesn't have to be serialized in memory at once.
+
+    :param directory: the listed directory.
+    :param entries: the child entries to serialize.
+    :param total: the number of all children of the directory.
+    :param pagination: the :class:`~flask_autoindex.pagination.Pagination`
+                       if the listing is paginated.
+    """
+    head = {'path': directory.path, 'total': total}
+    if pagination is not None:
+        head.update(page=pagination.page, pages=pagination.pages,
+                    limit=pagination.limit, next=pagination.next_cursor)
+    yield json.dumps(head)[:-1] + ', "entries": ['
+    separator = ''
+    for ent in entries:
+        yield separator + json.dumps(entry_record(ent))
+        separator = ', '
+    yield ']}\n'
+
+
+def generate_ndjson(records):
+    """Yields a line of JSON for each record."""
+    for record in records:
+        yield json.dumps(record) + '\n'
+
+
+def generate_csv(records):
+    """Yields a header row of :data:`FIELDS` and a CSV row for each record.
+    ``None`` becomes an empty cell.
+    """
+    buf = io.StringIO()
+    writer = csv.writer(buf)
+    writer.writerow(FIELDS)
+    for record in records:
+        writer.writerow([record[field] for field in FIELDS])
+        yield buf.getvalue()
+        buf.seek(0)
+        buf.truncate()
+    if buf.tell():
+        yield buf.getvalue()
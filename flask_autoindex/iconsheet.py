@@ -0,0 +1,100 @@
+# -*- coding: utf-8 -*-
+import base64
+import hashlib
+import re
+
+from .entry import Entry, _icon_map_key
+
+
+#: The rules which every icon class of a sheet shares.
+SHEET_HEAD = ('.sprite { display: inline-block; width: 16px; height: 16px;'
+              ' vertical-align: middle; background: no-repeat; }\n')
+
+
+def icon_class(icon):
+    """Returns the CSS class of an icon in an :class:`IconSheet`."""
+    return 'icon-' + re.sub(r'[^A-Za-z0-9_-]', '-', icon)
+
+
+def _entry_classes():
+    classes = [Entry]
+    for cls in classes:
+        classes.extend(sub for sub in cls.__subclasses__()
+                       if sub not in classes)
+    return classes
+
+
+class IconSheet(object):
+    """A stylesheet which has each icon that the icon rules of an autoindex
+    can pick as a data URI under its own CSS class. A listing refers to the
+    sheet once instead of requesting an icon for each row. Icons picked by
+    functions can't be known in advance, so they are not in the sheet.
+
+    The sheet is built on the first use and again after icon rules were
+    added.
+
+    :param autoindex: the :class:`~flask_autoindex.AutoIndex`.
+    :param icon_table: the :class:`~flask_autoindex.assets.IconTable` to
+                       find icons in.
+    """
+
+    def __init__(self, autoindex, icon_table):
+        self.autoindex = autoindex
+        self.icon_table = icon_table
+        self._built = None
+
+    def _owners(self):
+        return [self.autoindex] + _entry_classes()
+
+    def _key(self):
+        """Identifies the icon rules which the sheet was built from."""
+        key = []
+        for owner in self._owners():
+            icon_map = getattr(owner, 'icon_map', None) or ()
+            key.append((owner, _icon_map_key(icon_map),
+                        getattr(owner, 'default_icon', None)))
+        return (tuple(key), tuple(self.icon_table.directories))
+
+    def icons(self):
+        """Returns the names of icons which the icon rules can pick."""
+        icons = set()
+        for owner in self._owners():
+            for icon, rule in getattr(owner, 'icon_map', None) or ():
+                if isinstance(icon, str):
+                    icons.add(icon)
+            for attr in ('default_icon', 'fallback_icon'):
+                icon = getattr(owner, attr, None)
+                if isinstance(icon, str):
+                    icons.add(icon)
+        return icons
+
+    def _build(self):
+        key = self._key()
+        if self._built is not None and self._built[0] == key:
+            return self._built
+        uris = {}
+        for icon in sorted(self.icons()):
+            asset = self.icon_table.get(icon)
+            if asset is not None:
+                data = base64.b64encode(asset.data).decode('ascii')
+                uris[icon] = 'data:{0};base64,{1}'.format(asset.mimetype, data)
+        css = SHEET_HEAD + ''.join(
+            '.{0} {{ background-image: url("{1}"); }}\n'.format(
+                icon_class(icon), uris[icon]) for icon in sorted(uris))
+        version = hashlib.sha1(css.encode('utf-8')).hexdigest()[:12]
+        self._built = (key, uris, css, version)
+        return self._built
+
+    @property
+    def css(self):
+        """The stylesheet."""
+        return self._build()[2]
+
+    @property
+    def version(self):
+        """A hash of the stylesheet which changes with it."""
+        return self._build()[3]
+
+    def uris(self):
+        """Returns the data URIs of the icons in the sheet by their names."""
+        return self._build()[1]
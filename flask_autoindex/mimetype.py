@@ -0,0 +1,103 @@
+# -*- coding: utf-8 -*-
+import mimetypes
+import os
+
+from .cache import LRUCache
+
+
+#: Known signatures at the beginning of files and their mimetypes.
+SIGNATURES = [
+    (b'\x89PNG\r\n\x1a\n', 'image/png'),
+    (b'\xff\xd8\xff', 'image/jpeg'),
+    (b'GIF87a', 'image/gif'),
+    (b'GIF89a', 'image/gif'),
+    (b'%PDF-', 'application/pdf'),
+    (b'PK\x03\x04', 'application/zip'),
+    (b'\x1f\x8b', 'application/gzip'),
+    (b'BZh', 'application/x-bzip2'),
+    (b'\xfd7zXZ\x00', 'application/x-xz'),
+    (b'7z\xbc\xaf\x27\x1c', 'application/x-7z-compressed'),
+    (b'\x7fELF', 'application/x-executable'),
+    (b'ID3', 'audio/mpeg'),
+    (b'OggS', 'audio/ogg'),
+    (b'<?xml', 'text/xml'),
+]
+
+_by_extension = LRUCache(maxsize=4096)
+_by_content = LRUCache(maxsize=4096)
+
+
+def _extension(name):
+    """Returns the part of a name which :func:`mimetypes.guess_type` looks at:
+    the last two extensions, because the last one may be an encoding.
+    """
+    name = name.lstrip('.')
+    last = name.rfind('.')
+    if last < 0:
+        return ''
+    return name[name.rfind('.', 0, last) + 1:]
+
+
+def guess_type(name):
+    """Same as :func:`mimetypes.guess_type`, but the result is cached by the
+    extension of `name`. Returns a tuple of the type and the encoding.
+    """
+    ext = _extension(os.path.basename(name))
+    if not ext:
+        return (None, None)
+    guessed = _by_extension.get(ext)
+    if guessed is None:
+        guessed = mimetypes.guess_type('_.' + ext)
+        _by_extension.set(ext, guessed)
+    return guessed
+
+
+def sniff_type(path, stat=None, size=512):
+    """Guesses the mimetype of a file from the first `size` bytes of it. The
+    result is cached until the file changes. Returns a tuple of the type and
+    the encoding like :func:`guess_type`.
+
+    :param stat: the stat of the file if the caller already has one.
+    """
+    if stat is None:
+        stat = os.stat(path)
+    key = (path, stat.st_ino, stat.st_size, stat.st_mtime_ns)
+    guessed = _by_content.get(key)
+    if guessed is None:
+        try:
+            with open(path, 'rb') as f:
+                guessed = (_sniff(f.read(size)), None)
+        except OSError:
+            guessed = (None, None)
+        _by_content.set(key, guessed)
+    return guessed
+
+
+def _sniff(data):
+    if not data:
+        return None
+    for signature, mimetype in SIGNATURES:
+        if data.startswith(signature):
+            return mimetype
+    if b'\0' in data:
+        return None
+    try:
+        text = data.decode('utf-8')
+    except UnicodeDecodeError as e:
+        # A multibyte character may be cut at the end.
+        if e.start < len(data) - 3:
+            return None
+        text = data[:e.start].decode('utf-8')
+    if text.lstrip()[:14].lower().startswith(('<!doctype html', '<html')):
+        return 'text/html'
+    return 'text/plain'
+
+
+def guess_file_type(path, stat=None, sniff=False):
+    """Guesses the mimetype of a file by its name, and by its content if
+    `sniff` is ``True`` and the name doesn't tell.
+    """
+    guessed = guess_type(path)
+    if guessed[0] is None and sniff:
+        guessed = sniff_type(path, stat)
+    return guessed
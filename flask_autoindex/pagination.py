@@ -0,0 +1,104 @@
+# -*- coding: utf-8 -*-
+import base64
+import binascii
+import json
+from urllib.parse import urlencode
+
+
+def encode_cursor(offset, name):
+    """Makes an opaque cursor which points after the entry named `name` at
+    `offset`.
+    """
+    data = json.dumps([offset, name], separators=(',', ':')).encode('utf-8')
+    return base64.urlsafe_b64encode(data).decode('ascii').rstrip('=')
+
+
+def decode_cursor(cursor):
+    """Returns the offset and the name in a cursor, or ``None`` if the cursor
+    is broken.
+    """
+    try:
+        data = base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4))
+        offset, name = json.loads(data.decode('utf-8'))
+    except (binascii.Error, UnicodeDecodeError, ValueError, TypeError):
+        return None
+    if not isinstance(offset, int) or offset < 0 or not isinstance(name, str):
+        return None
+    return (offset, name)
+
+
+def resolve_cursor(cursor, entries):
+    """Returns the offset where the page after `cursor` starts in the sorted
+    `entries`. If the last entry of the previous page moved, the page starts
+    right after it, so entries added or removed before it don't make pages
+    skip or repeat entries.
+    """
+    offset, name = cursor
+    if 0 < offset <= len(entries) and entries[offset - 1].name == name:
+        return offset
+    for index, ent in enumerate(entries):
+        if ent.name == name:
+            return index + 1
+    return offset
+
+
+class Pagination(object):
+    """A page of a directory listing.
+
+    :param page: the page number which starts from ``1``.
+    :param limit: the number of entries in a page.
+    :param total: the number of all entries.
+    :param offset: the index of the first entry in the page.
+    :param entries: the entries in the page.
+    :param args: the query arguments to keep in the links to other pages.
+    """
+
+    #: The number of page links around the current page.
+    window = 2
+
+    def __init__(self, page, limit, total, offset, entries, args=None):
+        self.page = page
+        self.limit = limit
+        self.total = total
+        self.offset = offset
+        self.entries = entries
+        self.args = args or {}
+
+    @property
+    def pages(self):
+        """The number of pages."""
+        return max(1, -(-self.total // self.limit))
+
+    @property
+    def has_prev(self):
+        return self.page > 1
+
+    @property
+    def has_next(self):
+        return self.offset + len(self.entries) < self.total
+
+    @property
+    def next_cursor(self):
+        """The cursor of the next page, or ``None``."""
+        if not self.has_next or not self.entries:
+            return None
+        return encode_cursor(self.offset + len(self.entries),
+                             self.entries[-1].name)
+
+    def iter_pages(self):
+        """Yields page numbers to link. ``None`` stands for skipped pages."""
+        last = 0
+        for page in range(1, self.pages + 1):
+            if page in (1, self.pages) or \
+               abs(page - self.page) <= self.window:
+                if page > last + 1:
+                    yield None
+                yield page
+                last = page
+
+    def query(self, page):
+        """Returns the query string for a link to `page`."""
+        args = dict(self.args, page=page, limit=self.limit)
+        if page == self.page + 1 and self.next_cursor:
+            args['cursor'] = self.next_cursor
+        return urlencode(sorted(args.items()))
@@ -0,0 +1,99 @@
+# -*- coding: utf-8 -*-
+import os
+from urllib.parse import quote as url_quote
+
+from flask import url_for
+from jinja2.filters import do_filesizeformat
+from markupsafe import escape
+
+from .cache import LRUCache
+
+
+#: The default template whose rows :class:`RowRenderer` writes.
+DEFAULT_TEMPLATE = os.path.join(os.path.dirname(__file__), 'templates',
+                                '__autoindex__', 'autoindex.html')
+
+#: The markup of a row in the default template. Keep it in sync with the
+#: loop over entries in ``autoindex.html``.
+ROW_FORMAT = ('\n        <tr>'
+              '\n          <td class="icon">{icon}</td>'
+              '\n          <td class="name">'
+              '\n            <a href="{href}">{name}</a>{browse}'
+              '\n          </td>'
+              '\n          <td class="modified"><time datetime="{modified}">'
+              '{modified}</time></td>'
+              '\n          <td class="size">{size}</td>'
+              '\n        </tr>')
+
+#: The markup of the link to browse an archive.
+BROWSE_FORMAT = ('\n            <a class="browse" href="{href}">browse</a>')
+
+_marker = '__autoindex_path__'
+_sizes = LRUCache(maxsize=4096)
+
+
+def format_size(size):
+    """Formats a file size like the ``filesizeformat`` filter of Jinja2. The
+    results are cached.
+    """
+    formatted = _sizes.get(size)
+    if formatted is None:
+        formatted = str(escape(do_filesizeformat(size)))
+        _sizes.set(size, formatted)
+    return formatted
+
+
+class RowRenderer(object):
+    """Writes the rows of the default template without Jinja2. The rows are
+    the same markup as the template renders. It has to be made in a request
+    context.
+
+    :param endpoint: the endpoint of the autoindex.
+    :param render_icon: a function which renders the icon of an entry.
+    """
+
+    def __init__(self, endpoint, render_icon):
+        # The url of each entry differs only in its path.
+        url = url_for(endpoint, path=_marker)
+        self.url_prefix, _, self.url_suffix = url.rpartition(_marker)
+        self.render_icon = render_icon
+
+    def url(self, path):
+        """Returns the url of a path like :func:`flask.url_for`."""
+        return self.url_prefix + url_quote(path, safe='/:') + self.url_suffix
+
+    def render(self, ent):
+        """Returns the markup of the row of an entry."""
+        if ent.name == '..':
+            name = 'Parent folder'
+        else:
+            name = escape(ent.name)
+        if getattr(ent, 'browsable', False):
+            browse = BROWSE_FORMAT.format(href=escape(self.url(ent.path + '/')))
+        else:
+            browse = ''
+        size = getattr(ent, 'size', None)
+        return ROW_FORMAT.format(icon=self.render_icon(ent),
+                                 href=escape(self.url(ent.path)),
+                                 name=name, browse=browse,
+                                 modified=escape(ent.modified),
+                                 size=format_size(size) if size else '-')
+
+    def iter_chunks(self, entries, buffer=100):
+        """Yields the rows of entries as UTF-8 byte chunks of `buffer` rows."""
+        render = self.render
+        rows = []
+        for ent in entries:
+            rows.append(render(ent))
+            if len(rows) >= buffer:
+                yield ''.join(rows).encode('utf-8')
+                rows = []
+        if rows:
+            yield ''.join(rows).encode('utf-8')
+
+    def write(self, entries, chunks, buffer=100):
+        """Appends the rows of entries to a list of byte chunks. Returns the
+        list.
+        """
+        chunks.extend(self.iter_chunks(entries, buffer))
+        return chunks
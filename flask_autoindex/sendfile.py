@@ -0,0 +1,214 @@
+# -*- coding: utf-8 -*-
+import os
+import time
+import unicodedata
+from urllib.parse import quote
+from zlib import adler32
+
+from flask import current_app, request
+from werkzeug.http import is_resource_modified
+from werkzeug.wsgi import wrap_file
+
+
+#: The block size to read files which can't be handed to the server.
+BUFFER_SIZE = 1024 * 1024
+
+#: A request with more byte ranges than this gets the whole file.
+MAX_RANGES = 16
+
+#: The headers which make front servers send files, by offload mode.
+OFFLOAD_HEADERS = {'x-sendfile': 'X-Sendfile',
+                   'x-accel-redirect': 'X-Accel-Redirect'}
+
+
+def serve_file(path, mimetype, stat=None, encoding=None,
+               buffer_size=BUFFER_SIZE, offload=None):
+    """Sends a file like :func:`flask.send_file`, but it answers single and
+    multiple byte ranges of ``Range`` requests. A body which runs to the end
+    of the file goes through ``wsgi.file_wrapper``, so servers such as
+    gunicorn or uWSGI can send it by ``sendfile(2)`` without copying it
+    through Python. Other bodies are read in blocks of `buffer_size` bytes.
+
+    :param path: the path of the file.
+    :param mimetype: the mimetype of the file.
+    :param stat: the stat of the file if the caller already has one.
+    :param encoding: the content coding of the file such as ``'gzip'``.
+    :param buffer_size: the block size to read the file.
+    :param offload: a tuple of a header such as ``'X-Accel-Redirect'`` and
+                    its value. If it is given, the body is left to the front
+                    server which understands the header.
+    """
+    if stat is None:
+        stat = os.stat(path)
+    size = stat.st_size
+    response = current_app.response_class(None, mimetype=mimetype,
+                                          direct_passthrough=True)
+    response.headers.set('Content-Disposition', 'inline',
+                         **_filenames(os.path.basename(path)))
+    if encoding is not None:
+        response.content_encoding = encoding
+    etag = '{0}-{1}-{2}'.format(stat.st_mtime, size,
+                                adler32(path.encode('utf-8')) & 0xffffffff)
+    response.set_etag(etag)
+    response.last_modified = stat.st_mtime
+    response.accept_ranges = 'bytes'
+    _set_max_age(response, path)
+    if not is_resource_modified(request.environ, etag,
+                                last_modified=response.last_modified):
+        response.status_code = 304
+        return response
+    if offload is not None:
+        # The front server sends the file and its length.
+        response.headers[offload[0]] = offload[1]
+        return response
+    ranges = _requested_ranges(etag, stat.st_mtime, size)
+    if ranges == []:
+        response.status_code = 416
+        response.content_range = 'bytes */{0}'.format(size)
+        return response
+    f = open(path, 'rb')
+    response.call_on_close(f.close)
+    if ranges is None or len(ranges) == 1:
+        start, stop = ranges[0] if ranges else (0, size)
+        if ranges:
+            response.status_code = 206
+            response.content_range = 'bytes {0}-{1}/{2}'.format(
+                start, stop - 1, size)
+        f.seek(start)
+        if stop == size:
+            response.response = wrap_file(request.environ, f, buffer_size)
+        else:
+            response.response = _read(f, start, stop, buffer_size)
+        response.content_length = stop - start
+    else:
+        boundary = '{0:x}{1:x}'.format(int(time.time() * 1e6), id(f))
+        parts = [(_part_header(boundary, mimetype, start, stop, size),
+                  start, stop) for start, stop in ranges]
+        trailer = '--{0}--\r\n'.format(boundary).encode('ascii')
+        response.status_code = 206
+        response.content_type = \
+            'multipart/byteranges; boundary={0}'.format(boundary)
+        response.response = _read_parts(f, parts, trailer, buffer_size)
+        response.content_length = sum(
+            len(header) + stop - start + 2 for header, start, stop in parts
+        ) + len(trailer)
+    return response
+
+
+def serve_fileobj(f, name, mimetype, size, mtime, etag, encoding=None,
+                  buffer_size=BUFFER_SIZE):
+    """Sends a file object which can't seek, such as a file in an archive, as
+    a whole. Conditional requests are answered, but ranges are not.
+
+    :param f: the file object. It is closed with the response.
+    :param name: the file name for ``Content-Disposition``.
+    :param mimetype: the mimetype of the file.
+    :param size: the size of the file.
+    :param mtime: the modification time of the file.
+    :param etag: the ETag of the file.
+    :param encoding: the content coding of the file such as ``'gzip'``.
+    :param buffer_size: the block size to read the file.
+    """
+    response = current_app.response_class(None, mimetype=mimetype,
+                                          direct_passthrough=True)
+    response.headers.set('Content-Disposition', 'inline',
+                         **_filenames(name))
+    if encoding is not None:
+        response.content_encoding = encoding
+    response.set_etag(etag)
+    response.last_modified = mtime
+    _set_max_age(response, name)
+    if not is_resource_modified(request.environ, etag,
+                                last_modified=response.last_modified):
+        f.close()
+        response.status_code = 304
+        return response
+    response.response = wrap_file(request.environ, f, buffer_size)
+    response.content_length = size
+    return response
+
+
+def _filenames(name):
+    """Returns the file name parameters of ``Content-Disposition`` like
+    :func:`flask.send_file` makes them. A name which isn't ASCII also gets
+    ``filename*`` in UTF-8.
+    """
+    try:
+        name.encode('ascii')
+    except UnicodeEncodeError:
+        simple = unicodedata.normalize('NFKD', name)
+        simple = simple.encode('ascii', 'ignore').decode('ascii')
+        return {'filename': simple,
+                'filename*': "UTF-8''{0}".format(quote(name, safe=''))}
+    return {'filename': name}
+
+
+def _set_max_age(response, path):
+    """Sets the cache control like :func:`flask.send_file`."""
+    response.cache_control.no_cache = True
+    max_age = current_app.get_send_file_max_age(path)
+    if max_age is not None:
+        if max_age > 0:
+            response.cache_control.no_cache = None
+            response.cache_control.public = True
+        response.cache_control.max_age = max_age
+        response.expires = int(time.time() + max_age)
+
+
+def _requested_ranges(etag, mtime, size):
+    """Returns the sorted and merged byte ranges to send as a list of
+    ``(start, stop)``, ``[]`` if none of them is satisfiable, or ``None`` if
+    the whole file should be sent.
+    """
+    rng = request.range
+    if rng is None or rng.units != 'bytes' or len(rng.ranges) > MAX_RANGES:
+        return None
+    if_range = request.if_range
+    if if_range.etag is not None and if_range.etag != etag:
+        return None
+    if if_range.date is not None and \
+       int(mtime) > if_range.date.timestamp():
+        return None
+    ranges = []
+    for start, stop in rng.ranges:
+        if start < 0:
+            start, stop = max(0, size + start), size
+        elif stop is None or stop > size:
+            stop = size
+        if start < stop:
+            ranges.append((start, stop))
+    ranges.sort()
+    merged = []
+    for start, stop in ranges:
+        if merged and start <= merged[-1][1]:
+            merged[-1] = (merged[-1][0], max(merged[-1][1], stop))
+        else:
+            merged.append((start, stop))
+    return merged
+
+
+def _part_header(boundary, mimetype, start, stop, size):
+    return ('--{0}\r\nContent-Type: {1}\r\n'
+            'Content-Range: bytes {2}-{3}/{4}\r\n\r\n').format(
+        boundary, mimetype, start, stop - 1, size).encode('latin-1')
+
+
+def _read(f, start, stop, buffer_size):
+    """Yields the bytes of a file from `start` to `stop` in blocks."""
+    f.seek(start)
+    remaining = stop - start
+    while remaining > 0:
+        data = f.read(min(buffer_size, remaining))
+        if not data:
+            break
+        remaining -= len(data)
+        yield data
+
+
+def _read_parts(f, parts, trailer, buffer_size):
+    for header, start, stop in parts:
+        yield header
+        for data in _read(f, start, stop, buffer_size):
+            yield data
+        yield b'\r\n'
+    yield trailer
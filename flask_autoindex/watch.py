@@ -0,0 +1,272 @@
+# -*- coding: utf-8 -*-
+import ctypes
+import ctypes.util
+import errno
+import os
+import select
+import struct
+import sys
+import threading
+
+
+class Watcher(object):
+    """Watches directories and calls ``callback(path, name)`` from a
+    background thread when something in a watched directory changes. `name`
+    is the name of the changed child, or ``None`` if the directory itself or
+    anything in it may have changed.
+
+    Directories are watched lazily by :meth:`watch`, so only the directories
+    which have actually been listed cost a watch.
+
+    :param callback: the function to call on a change.
+    :param maxwatches: the maximum number of watched directories.
+    """
+
+    def __init__(self, callback, maxwatches=100000):
+        self.callback = callback
+        self.maxwatches = maxwatches
+        self._lock = threading.Lock()
+        self._thread = None
+        self._closed = False
+
+    def watch(self, path):
+        """Starts to watch the directory. Returns ``True`` if the directory
+        is watched.
+        """
+        raise NotImplementedError()
+
+    def unwatch(self, path):
+        """Stops watching the directory."""
+        raise NotImplementedError()
+
+    def close(self):
+        """Stops watching every directory. Closing it again does nothing.
+        Returns ``True`` if it was open.
+        """
+        with self._lock:
+            if self._closed:
+                return False
+            self._closed = True
+        return True
+
+    def _start(self):
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run,
+                                            name=type(self).__name__)
+            self._thread.daemon = True
+            self._thread.start()
+
+    def _run(self):
+        raise NotImplementedError()
+
+    def _notify(self, path, name=None):
+        try:
+            self.callback(path, name)
+        except Exception:
+            pass  # keep the watcher thread alive
+
+
+class PollingWatcher(Watcher):
+    """A :class:`Watcher` which stats the watched directories every
+    `interval` seconds. It notices only the changes which touch the mtime or
+    ctime of a directory, such as adding, removing or renaming a child.
+    """
+
+    def __init__(self, callback, maxwatches=100000, interval=1.0):
+        super(PollingWatcher, self).__init__(callback, maxwatches)
+        self.interval = interval
+        self._fingerprints = {}
+        self._wakeup = threading.Event()
+
+    @staticmethod
+    def _fingerprint(path):
+        try:
+            st = os.stat(path)
+        except OSError:
+            return None
+        return (st.st_dev, st.st_ino, st.st_mtime_ns, st.st_ctime_ns)
+
+    def watch(self, path):
+        with self._lock:
+            if self._closed:
+                return False
+            if path in self._fingerprints:
+                return True
+            if len(self._fingerprints) >= self.maxwatches:
+                return False
+            self._fingerprints[path] = self._fingerprint(path)
+            self._start()
+        return True
+
+    def unwatch(self, path):
+        with self._lock:
+            self._fingerprints.pop(path, None)
+
+    def close(self):
+        if not super(PollingWatcher, self).close():
+            return False
+        with self._lock:
+            self._fingerprints.clear()
+        self._wakeup.set()
+        return True
+
+    def _run(self):
+        while not self._closed:
+            self._wakeup.wait(self.interval)
+            with self._lock:
+                paths = list(self._fingerprints.items())
+            for path, fingerprint in paths:
+                current = self._fingerprint(path)
+                if current == fingerprint:
+                    continue
+                with self._lock:
+                    if path not in self._fingerprints:
+                        continue
+                    if current is None:
+                        del self._fingerprints[path]
+                    else:
+                        self._fingerprints[path] = current
+                self._notify(path)
+
+
+class InotifyWatcher(Watcher):
+    """A :class:`Watcher` built on Linux inotify through :mod:`ctypes`. It
+    also notices files changed in place in a watched directory.
+    """
+
+    IN_MODIFY = 0x00000002
+    IN_ATTRIB = 0x00000004
+    IN_CLOSE_WRITE = 0x00000008
+    IN_MOVED_FROM = 0x00000040
+    IN_MOVED_TO = 0x00000080
+    IN_CREATE = 0x00000100
+    IN_DELETE = 0x00000200
+    IN_DELETE_SELF = 0x00000400
+    IN_MOVE_SELF = 0x00000800
+    IN_Q_OVERFLOW = 0x00004000
+    IN_IGNORED = 0x00008000
+    IN_ONLYDIR = 0x01000000
+
+    MASK = (IN_MODIFY | IN_ATTRIB | IN_CLOSE_WRITE | IN_MOVED_FROM |
+            IN_MOVED_TO | IN_CREATE | IN_DELETE | IN_DELETE_SELF |
+            IN_MOVE_SELF | IN_ONLYDIR)
+
+    EVENT = struct.Struct('iIII')
+
+    _libc = None
+
+    @classmethod
+    def available(cls):
+        """Returns ``True`` if inotify can be used."""
+        if not sys.platform.startswith('linux'):
+            return False
+        if cls._libc is None:
+            try:
+                libc = ctypes.CDLL(ctypes.util.find_library('c') or
+                                   'libc.so.6', use_errno=True)
+                for func in ['inotify_init1', 'inotify_add_watch',
+                             'inotify_rm_watch']:
+                    getattr(libc, func)
+            except (OSError, AttributeError):
+                return False
+            libc.inotify_add_watch.argtypes = [ctypes.c_int, ctypes.c_char_p,
+                                               ctypes.c_uint32]
+            cls._libc = libc
+        return True
+
+    def __init__(self, callback, maxwatches=100000):
+        super(InotifyWatcher, self).__init__(callback, maxwatches)
+        if not self.available():
+            raise OSError(errno.ENOSYS, 'inotify is not available')
+        self._fd = self._libc.inotify_init1(os.O_CLOEXEC | os.O_NONBLOCK)
+        if self._fd < 0:
+            err = ctypes.get_errno()
+            raise OSError(err, os.strerror(err))
+        self._pipe = os.pipe()
+        self._paths = {}
+        self._wds = {}
+
+    def watch(self, path):
+        with self._lock:
+            if self._closed:
+                return False
+            if path in self._wds:
+                return True
+            if len(self._wds) >= self.maxwatches:
+                return False
+            wd = self._libc.inotify_add_watch(self._fd, os.fsencode(path),
+                                              self.MASK)
+            if wd < 0:
+                # ENOSPC means that the inotify watch limit was reached.
+                return False
+            self._paths[wd] = path
+            self._wds[path] = wd
+            self._start()
+        return True
+
+    def unwatch(self, path):
+        with self._lock:
+            wd = self._wds.pop(path, None)
+            if wd is not None:
+                self._paths.pop(wd, None)
+                self._libc.inotify_rm_watch(self._fd, wd)
+
+    def close(self):
+        if not super(InotifyWatcher, self).close():
+            return False
+        if self._thread is None:
+            self._close()
+        else:
+            # Wakes the thread up. It closes the descriptors on its way out.
+            os.write(self._pipe[1], b'x')
+        return True
+
+    def _close(self):
+        for fd in (self._fd,) + self._pipe:
+            os.close(fd)
+
+    def _run(self):
+        try:
+            while not self._closed:
+                select.select([self._fd, self._pipe[0]], [], [])
+                try:
+                    data = os.read(self._fd, 65536)
+                except BlockingIOError:
+                    continue
+                self._dispatch(data)
+        finally:
+            self._close()
+
+    def _dispatch(self, data):
+        offset = 0
+        while offset < len(data):
+            wd, mask, cookie, length = self.EVENT.unpack_from(data, offset)
+            offset += self.EVENT.size
+            name = data[offset:offset + length].rstrip(b'\0')
+            offset += length
+            if mask & self.IN_Q_OVERFLOW:
+                # Events were lost. Every directory may have changed.
+                with self._lock:
+                    paths = list(self._wds)
+                for path in paths:
+                    self._notify(path)
+                continue
+            with self._lock:
+                path = self._paths.get(wd)
+                if path is not None and mask & self.IN_IGNORED:
+                    del self._paths[wd]
+                    del self._wds[path]
+            if path is not None:
+                self._notify(path, os.fsdecode(name) if name else None)
+
+
+def make_watcher(callback, maxwatches=100000):
+    """Makes an :class:`InotifyWatcher` if inotify is available, or a
+    :class:`PollingWatcher` otherwise.
+    """
+    if InotifyWatcher.available():
+        try:
+            return InotifyWatcher(callback, maxwatches)
+        except OSError:
+            pass
+    return PollingWatcher(callback, maxwatches)
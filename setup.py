@@ -41,6 +41,7 @@ setup(
     zip_safe=False,
     platforms='any',
     install_requires=['Flask>=1.1', 'Flask-Silk>=0.2'],
+    extras_require={'brotli': ['Brotli']},
     test_suite='__main__.run_tests',
     classifiers=[
         'Development Status :: 4 - Beta',
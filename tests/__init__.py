@@ -1,11 +1,29 @@
+import csv
+import gzip
+import io
+import json
 import mimetypes
 import os
+import re
+import shutil
 import sys
+import tarfile
+import tempfile
+import time
 import unittest
+import zipfile
 from pathlib import Path
 
 from flask import *
 from flask_autoindex import *
+import flask_autoindex
+from flask_autoindex.entry import _IconRule, _make_sort_key
+from flask_autoindex.cache import LRUCache, ListingCache, WeakLRUCache
+from flask_autoindex.compress import negotiate
+from flask_autoindex.mimetype import guess_type
+from flask_autoindex.pagination import decode_cursor
+from flask_autoindex.watch import InotifyWatcher, PollingWatcher
+from jinja2 import DictLoader
 
 __file__ = __file__.replace('.pyc', '.py')
 browse_root = os.path.abspath(os.path.dirname(__file__))
@@ -134,6 +152,300 @@ class FileTestCase(unittest.TestCase):
         assert self.itself.mimetype == mimetypes.guess_type(__file__)
 
 
+class ExploreTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.path = tempfile.mkdtemp()
+        os.mkdir(os.path.join(self.path, 'dir'))
+        open(os.path.join(self.path, 'file.txt'), 'w').close()
+        open(os.path.join(self.path, '.hidden'), 'w').close()
+        os.symlink(os.path.join(self.path, 'nowhere'),
+                   os.path.join(self.path, 'broken'))
+        os.symlink(self.path, os.path.join(self.path, 'loop'))
+        self.rootdir = RootDirectory(self.path)
+
+    def tearDown(self):
+        shutil.rmtree(self.path)
+
+    def test_explore(self):
+        entries = list(self.rootdir.explore())
+        names = [ent.name for ent in entries]
+        assert 'broken' not in names
+        assert '.hidden' not in names
+        assert isinstance(entries[names.index('dir')], Directory)
+        assert isinstance(entries[names.index('file.txt')], File)
+        hidden = list(self.rootdir.explore(show_hidden=True))
+        assert '.hidden' in [ent.name for ent in hidden]
+        assert self.rootdir in hidden
+
+    def test_sort(self):
+        for name, size in [('b.txt', 2), ('a.txt', 2), ('c.txt', 1)]:
+            with open(os.path.join(self.path, name), 'w') as f:
+                f.write('x' * size)
+        names = lambda *args: [ent.name for ent in self.rootdir.explore(*args)]
+        assert names('size,name') == ['dir', 'file.txt', 'c.txt',
+                                      'a.txt', 'b.txt']
+        assert names('size,name', -1) == ['dir', 'b.txt', 'a.txt',
+                                          'c.txt', 'file.txt']
+        assert names('name', -1) == ['dir', 'file.txt', 'c.txt',
+                                     'b.txt', 'a.txt']
+
+    def test_sort_missing(self):
+        for name in ['b.txt', 'a.unknownext', 'c']:
+            open(os.path.join(self.path, name), 'w').close()
+        names = lambda *args: [ent.name for ent in self.rootdir.explore(*args)]
+        # Only name, modified and size are sortable.
+        assert names('mimetype') == names('name') == names('')
+        assert names('mimetype,__class__', -1) == names('name', -1)
+        # Entries without a property come first.
+        class Entry(object):
+            def __init__(self, name, size):
+                self.name, self.size = name, size
+        entries = [Entry('a', 1), Entry('b', None), Entry('c', 0),
+                   Entry('d', None)]
+        entries.sort(key=_make_sort_key('size'))
+        assert [ent.name for ent in entries] == ['b', 'd', 'c', 'a']
+
+    def test_stat_snapshot(self):
+        file = self.rootdir.get_child('file.txt')
+        explored, = [e for e in self.rootdir.explore() if e.name == 'file.txt']
+        assert file.size == explored.size == 0
+        with open(file.abspath, 'w') as f:
+            f.write('Hello, world!')
+        assert file.size == explored.size == 0
+        assert file.refresh().size == 13
+        assert file.inode == os.stat(file.abspath).st_ino
+        list(self.rootdir.explore())
+        assert explored.size == 13
+
+    def test_walk(self):
+        os.mkdir(os.path.join(self.path, 'dir', 'sub'))
+        open(os.path.join(self.path, 'dir', 'a.txt'), 'w').close()
+        os.symlink(os.path.join(self.path, 'dir'),
+                   os.path.join(self.path, 'dir', 'up'))
+        paths = lambda *args, **kwargs: [
+            ent.path for ent in self.rootdir.walk(*args, **kwargs)]
+        assert paths() == ['dir', 'dir/a.txt', 'dir/sub', 'dir/up',
+                           'file.txt']
+        assert paths(1) == ['dir', 'file.txt']
+        assert '.hidden' in paths(show_hidden=True)
+        assert paths(after='dir') == paths()[1:]
+        assert paths(after='dir/a.txt') == paths()[2:]
+        os.rmdir(os.path.join(self.path, 'dir', 'sub'))
+        assert paths(after='dir/sub') == ['dir/up', 'file.txt']
+        directory = self.rootdir.get_child('dir')
+        assert [e.path for e in directory.walk(after='dir/a.txt')] == \
+               ['dir/up']
+        self.assertRaises(ValueError, directory.walk, after='file.txt')
+        self.assertRaises(ValueError, self.rootdir.walk, after='../etc')
+
+    def test_same_object(self):
+        entries = list(self.rootdir.explore())
+        assert entries == list(self.rootdir.explore())
+        for ent in entries:
+            if ent is not self.rootdir:
+                assert ent is Entry(ent.path, self.rootdir)
+
+
+class CacheTestCase(unittest.TestCase):
+
+    def test_lru(self):
+        cache = LRUCache(maxsize=2)
+        cache['a'] = 1
+        cache['b'] = 2
+        assert cache['a'] == 1
+        cache['c'] = 3
+        assert 'b' not in cache
+        assert cache.get('b') is None
+        assert cache.stats() == {'hits': 1, 'misses': 1, 'evictions': 1,
+                                 'size': 2, 'weight': 2, 'hit_ratio': 0.5}
+
+    def test_ttl(self):
+        cache = LRUCache(ttl=0)
+        cache['a'] = 1
+        self.assertRaises(KeyError, lambda: cache['a'])
+        assert cache.evictions == 1
+
+    def test_weak(self):
+        class Value(object): pass
+        cache = WeakLRUCache(maxsize=1)
+        alive = cache['a'] = Value()
+        cache['b'] = Value()
+        assert 'a' not in cache
+        assert cache['a'] is alive
+        assert cache.get('b') is None
+
+    def test_descendants(self):
+        path = tempfile.mkdtemp()
+        try:
+            for x in range(10):
+                open(os.path.join(path, str(x)), 'w').close()
+            rootdir = RootDirectory(path)
+            rootdir._descendants.maxsize = 3
+            entries = list(rootdir.explore())
+            assert len(rootdir._descendants) == 3
+            for ent in entries:
+                assert ent is Entry(ent.path, rootdir)
+        finally:
+            shutil.rmtree(path)
+
+    def test_rootdir_cache(self):
+        app = Flask(__name__)
+        rootdirs = WeakLRUCache(maxsize=2)
+        idx = AutoIndex(app, browse_root, rootdir_cache=rootdirs)
+        assert idx.rootdir_cache is rootdirs
+        assert rootdirs[(browse_root, idx)] is idx.rootdir
+        assert RootDirectory(browse_root, idx) is idx.rootdir
+        assert (browse_root, idx) not in RootDirectory._rootdirs
+        with app.test_request_context('/'):
+            for name in ['blueprinttest', 'static']:
+                idx.render_autoindex('.', os.path.join(browse_root, name))
+        assert len(rootdirs) == 2
+
+    def test_listing(self):
+        path = tempfile.mkdtemp()
+        try:
+            rootdir = RootDirectory(path)
+            cache = ListingCache()
+            listing = cache.explore(rootdir)
+            assert listing == []
+            assert cache.explore(rootdir) is listing
+            assert cache.explore(rootdir, 'size') is not listing
+            open(os.path.join(path, 'new.txt'), 'w').close()
+            listing = cache.explore(rootdir)
+            assert [ent.name for ent in listing] == ['new.txt']
+            assert cache.stats()['hits'] == 1
+            assert cache.stats()['misses'] == 3
+            cache.invalidate(rootdir)
+            assert cache.explore(rootdir) is not listing
+        finally:
+            shutil.rmtree(path)
+
+
+class WatchTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.path = tempfile.mkdtemp()
+        with open(os.path.join(self.path, 'file.txt'), 'w') as f:
+            f.write('Hello')
+        self.rootdir = RootDirectory(self.path)
+
+    def tearDown(self):
+        shutil.rmtree(self.path)
+
+    def wait(self, until, timeout=5):
+        deadline = time.time() + timeout
+        while not until():
+            assert time.time() < deadline, 'no change was noticed'
+            time.sleep(0.01)
+
+    @unittest.skipUnless(InotifyWatcher.available(), 'requires inotify')
+    def test_inotify(self):
+        cache = ListingCache(watch=True)
+        assert isinstance(cache.watcher, InotifyWatcher)
+        try:
+            listing = cache.explore(self.rootdir)
+            assert cache.explore(self.rootdir) is listing
+            file, = listing
+            assert file.size == 5
+            # Writing to a file doesn't change the mtime of its directory.
+            with open(file.abspath, 'a') as f:
+                f.write(', world!')
+            self.wait(lambda: cache.explore(self.rootdir) is not listing)
+            assert file.size == 13
+            listing = cache.explore(self.rootdir)
+            open(os.path.join(self.path, 'new.txt'), 'w').close()
+            self.wait(lambda: cache.explore(self.rootdir) is not listing)
+            assert len(cache.explore(self.rootdir)) == 2
+        finally:
+            cache.watcher.close()
+
+    def test_change_while_listing(self):
+        cache = ListingCache(watch=True)
+        cache.watcher.close()
+        cache.watcher = PollingWatcher(lambda path, name: None)
+        cache.watcher.watch = lambda path: True
+        sort_children = self.rootdir.sort_children
+        def changing_sort_children(*args):
+            listing = sort_children(*args)
+            cache._changed(self.path)
+            return listing
+        self.rootdir.sort_children = changing_sort_children
+        listing = cache.explore(self.rootdir)
+        assert cache.explore(self.rootdir) is not listing
+        del self.rootdir.sort_children
+        listing = cache.explore(self.rootdir)
+        assert cache.explore(self.rootdir) is listing
+
+    def test_close_twice(self):
+        watchers = [PollingWatcher(lambda path, name: None)]
+        if InotifyWatcher.available():
+            watchers.append(InotifyWatcher(lambda path, name: None))
+        for watcher in watchers:
+            assert watcher.watch(self.path)
+            assert watcher.close()
+            assert not watcher.close()
+            assert not watcher.watch(self.path)
+
+    def test_unwatch_released(self):
+        os.mkdir(os.path.join(self.path, 'sub'))
+        cache = ListingCache(maxsize=1, watch=True)
+        watched = set()
+        cache.watcher.close()
+        cache.watcher = PollingWatcher(lambda path, name: None)
+        cache.watcher.watch = lambda path: watched.add(path) or True
+        cache.watcher.unwatch = watched.discard
+        sub = Directory('sub', self.rootdir)
+        cache.explore(self.rootdir)
+        assert watched == set([self.path])
+        cache.explore(sub)
+        assert watched == set([os.path.join(self.path, 'sub')])
+        cache.invalidate(sub)
+        assert watched == set()
+
+    def test_polling(self):
+        changes = []
+        watcher = PollingWatcher(lambda path, name: changes.append(path),
+                                 interval=0.01)
+        try:
+            assert watcher.watch(self.path)
+            open(os.path.join(self.path, 'new.txt'), 'w').close()
+            self.wait(lambda: changes)
+            assert changes[0] == self.path
+        finally:
+            watcher.close()
+
+
+class MimetypeTestCase(unittest.TestCase):
+
+    def test_guess_type(self):
+        names = os.listdir(os.path.join(browse_root, 'static'))
+        names += ['README', '.txt', 'a.TXT', 'a.tar.gz', 'a.tgz', 'a.b.c']
+        for name in names:
+            assert guess_type(name) == mimetypes.guess_type(name), name
+
+    def test_sniff_type(self):
+        path = tempfile.mkdtemp()
+        try:
+            app = Flask(__name__)
+            idx = AutoIndex(app, path, sniff_mimetypes=True)
+            for name, data in [('README', b'Hello, world!'),
+                               ('picture', b'\x89PNG\r\n\x1a\n\0\0'),
+                               ('binary', b'\0\1\2')]:
+                with open(os.path.join(path, name), 'wb') as f:
+                    f.write(data)
+            readme = idx.rootdir.get_child('README')
+            assert readme.mimetype == ('text/plain', None)
+            assert idx.rootdir.get_child('picture').mimetype[0] == 'image/png'
+            assert idx.rootdir.get_child('binary').mimetype == (None, None)
+            rv = app.test_client().get('/picture')
+            assert rv.mimetype == 'image/png'
+            rv = app.test_client().get('/binary')
+            assert rv.mimetype == 'application/octet-stream'
+        finally:
+            shutil.rmtree(path)
+
+
 class ApplicationTestCase(unittest.TestCase):
 
     def setUp(self):
@@ -209,6 +521,45 @@ class ApplicationTestCase(unittest.TestCase):
             assert original_icon_url.endswith('page_white_python.png')
             assert customized_icon_url.endswith('table.png')
 
+    def test_icon_rule_order(self):
+        with self.app.test_request_context():
+            js = self.idx.rootdir.get_child('static/test.js')
+            static = self.idx.rootdir.get_child('static')
+            self.idx.add_icon_rule('bug.png', ext=['js', 'json'])
+            self.idx.add_icon_rule('brick.png', rule=lambda ent: True)
+            self.idx.add_icon_rule('folder_picture.png', dirname='static')
+            assert js.guess_icon().endswith('bug.png')
+            assert static.guess_icon().endswith('brick.png')
+            self.idx.icon_map.insert(0, ('table.png', lambda ent: True))
+            assert js.guess_icon().endswith('table.png')
+
+    def test_icon_class_rules(self):
+        import abc
+        class Virtual(abc.ABC):
+            pass
+        Virtual.register(File)
+        with self.app.test_request_context():
+            file = self.idx.rootdir.get_child('__init__.py')
+            static = self.idx.rootdir.get_child('static')
+            self.idx.add_icon_rule('table.png', cls=Virtual)
+            assert file.guess_icon().endswith('table.png')
+            self.idx.icon_map[0] = ('bug.png', _IconRule('class', (Directory,
+                                                                  File)))
+            assert file.guess_icon().endswith('bug.png')
+            assert static.guess_icon().endswith('bug.png')
+
+    def test_icon_fallback(self):
+        file = self.idx.rootdir.get_child('__init__.py')
+        assert file.guess_icon() == 'page_white_python.png'
+        def broken_rule(ent):
+            raise ValueError('broken')
+        self.idx.add_icon_rule('table.png', rule=broken_rule)
+        with self.app.test_request_context():
+            with self.assertLogs(self.app.logger, 'ERROR'):
+                icon = file.guess_icon()
+        assert re.match(r'^/__icons__/\w+/' + re.escape(file.fallback_icon),
+                        icon)
+
     def test_parent_of_root(self):
         with self.app.test_request_context():
             assert self.get('.').status_code == 200
@@ -296,14 +647,967 @@ class SortTestCase(unittest.TestCase):
         asc = self.get('/asc')
         assert len(asc.data) != len(desc.data)
 
+    def test_sort_unknown(self):
+        app = Flask(__name__)
+        AutoIndex(app, browse_root, add_url_rules=True)
+        client = app.test_client()
+        for sort_by in ['mimetype', '-mimetype', 'nothing,size', '']:
+            rv = client.get('/?sort_by=' + sort_by)
+            assert rv.status_code == 200
+
+
+class PaginationTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.path = tempfile.mkdtemp()
+        for i in range(7):
+            open(os.path.join(self.path, 'file%d.txt' % i), 'w').close()
+        self.app = Flask(__name__)
+        self.idx = AutoIndex(self.app, self.path, add_url_rules=True,
+                             per_page=3)
+
+    def tearDown(self):
+        shutil.rmtree(self.path)
+
+    def get(self, path):
+        return self.app.test_client().get(path).get_data(as_text=True)
+
+    def names(self, data):
+        return re.findall(r'>(file\d)\.txt<', data)
+
+    def test_top_k(self):
+        rootdir = RootDirectory(self.path)
+        entries, total = rootdir.sort_children('name', -1, limit=2)
+        assert total == 7
+        assert [ent.name for ent in entries] == ['file6.txt', 'file5.txt']
+
+    def test_pages(self):
+        assert self.names(self.get('/')) == ['file0', 'file1', 'file2']
+        assert self.names(self.get('/?page=3')) == ['file6']
+        assert self.names(self.get('/?limit=5&page=2')) == ['file5', 'file6']
+        assert len(self.names(self.get('/?limit=0'))) == 7
+        data = self.get('/?page=2')
+        assert 'rel="prev"' in data and 'rel="next"' in data
+
+    def test_cursor(self):
+        data = self.get('/?sort_by=name')
+        cursor = re.search(r'cursor=([\w-]+)', data).group(1)
+        assert decode_cursor(cursor) == (3, 'file2.txt')
+        os.remove(os.path.join(self.path, 'file0.txt'))
+        data = self.get('/?sort_by=name&page=2&cursor=' + cursor)
+        assert self.names(data) == ['file3', 'file4', 'file5']
+        assert decode_cursor('garbage') is None
+
+
+class StreamTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.app = Flask(__name__)
+        self.idx = AutoIndex(self.app, browse_root, stream=True)
+        self.app2 = Flask(__name__)
+        AutoIndex(self.app2, browse_root)
+
+    def test_stream(self):
+        rv = self.app.test_client().get('/')
+        assert rv.is_streamed
+        assert rv.mimetype == 'text/html'
+        assert rv.data == self.app2.test_client().get('/').data
+
+    def test_first_chunk(self):
+        self.idx.stream_buffer = 2
+        rv = self.app.test_client().get('/', buffered=False)
+        assert rv.status_code == 200
+        chunk = next(iter(rv.response))
+        assert b'__init__.py' not in chunk
+        rv.close()
+
+
+class JSONTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.app = Flask(__name__)
+        AutoIndex(self.app, browse_root, per_page=2)
+
+    def get(self, path, **kwargs):
+        return self.app.test_client().get(path, **kwargs)
+
+    def test_format(self):
+        rv = self.get('/?format=json&limit=0')
+        assert rv.mimetype == 'application/json'
+        assert 'Accept' in rv.vary
+        listing = json.loads(rv.data)
+        assert listing['path'] == '.'
+        assert listing['total'] == len(listing['entries'])
+        init, = [e for e in listing['entries'] if e['name'] == '__init__.py']
+        path = os.path.join(browse_root, '__init__.py')
+        assert init['type'] == 'file'
+        assert init['path'] == '__init__.py'
+        assert init['size'] == os.path.getsize(path)
+        assert init['mtime'] == os.path.getmtime(path)
+        assert init['icon'].endswith('/page_white_python.png')
+
+    def test_accept(self):
+        rv = self.get('/static', headers={'Accept': 'application/json'})
+        listing = json.loads(rv.data)
+        assert listing['path'] == 'static'
+        assert listing['page'] == 1 and len(listing['entries']) == 2
+        assert '..' not in [e['name'] for e in listing['entries']]
+        rv = self.get('/', headers={'Accept': 'text/html,*/*'})
+        assert rv.mimetype == 'text/html'
+        assert json.loads(self.get('/?format=json').data)['next']
+
+
+class ExportTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.path = tempfile.mkdtemp()
+        os.mkdir(os.path.join(self.path, 'dir'))
+        with open(os.path.join(self.path, 'dir', 'a.txt'), 'w') as f:
+            f.write('Hello')
+        open(os.path.join(self.path, 'b.txt'), 'w').close()
+        self.app = Flask(__name__)
+        AutoIndex(self.app, self.path)
+
+    def tearDown(self):
+        shutil.rmtree(self.path)
+
+    def get(self, path):
+        return self.app.test_client().get(path)
+
+    def test_ndjson(self):
+        rv = self.get('/?format=ndjson')
+        assert rv.mimetype == 'application/x-ndjson'
+        records = [json.loads(line) for line in rv.data.splitlines()]
+        assert [r['path'] for r in records] == ['b.txt', 'dir', 'dir/a.txt']
+        assert records[2]['size'] == 5
+        rv = self.get('/?format=ndjson&after=dir')
+        assert json.loads(rv.data)['path'] == 'dir/a.txt'
+        rv = self.get('/?format=ndjson&depth=1')
+        assert len(rv.data.splitlines()) == 2
+        assert self.get('/dir?format=ndjson&after=b.txt').status_code == 400
+
+    def test_csv(self):
+        rv = self.get('/dir?format=csv')
+        assert rv.mimetype == 'text/csv'
+        rows = list(csv.reader(rv.get_data(as_text=True).splitlines()))
+        assert rows[0] == ['name', 'path', 'type', 'size', 'mtime', 'icon']
+        assert rows[1][:4] == ['a.txt', 'dir/a.txt', 'file', '5']
+        assert len(rows) == 2
+
+
+class ConditionalTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.path = tempfile.mkdtemp()
+        open(os.path.join(self.path, 'a.txt'), 'w').close()
+        self.app = Flask(__name__)
+        AutoIndex(self.app, self.path)
+
+    def tearDown(self):
+        shutil.rmtree(self.path)
+
+    def get(self, path, **headers):
+        return self.app.test_client().get(path, headers=headers)
+
+    def test_etag(self):
+        rv = self.get('/')
+        etag = rv.headers['ETag']
+        assert rv.status_code == 200 and 'Accept' in rv.vary
+        rv = self.get('/', **{'If-None-Match': etag})
+        assert rv.status_code == 304 and not rv.data
+        assert rv.headers['ETag'] == etag
+        assert self.get('/?sort_by=-name').headers['ETag'] != etag
+        assert self.get('/?format=json').headers['ETag'] != etag
+        open(os.path.join(self.path, 'b.txt'), 'w').close()
+        rv = self.get('/', **{'If-None-Match': etag})
+        assert rv.status_code == 200 and b'b.txt' in rv.data
+
+    def test_last_modified(self):
+        last_modified = self.get('/').headers['Last-Modified']
+        rv = self.get('/', **{'If-Modified-Since': last_modified})
+        assert rv.status_code == 304
+        rv = self.get('/', **{'If-Modified-Since': last_modified,
+                              'If-None-Match': '"other"'})
+        assert rv.status_code == 200
+
+    def test_etag_options_and_template(self):
+        app = Flask(__name__)
+        app.jinja_env.auto_reload = True
+        app.jinja_loader = DictLoader({'w.html': 'old'})
+        idx = AutoIndex(app, self.path, add_url_rules=False)
+        @app.route('/')
+        def index():
+            return idx.render_autoindex('.', template='w.html')
+        client = app.test_client()
+        os.utime(self.path, (time.time() - 10, time.time() - 10))
+        client.get('/')
+        for key in idx._markup_times.keys():
+            idx._markup_times.set(key, time.time() - 10)
+        rv = client.get('/')
+        etag, last_modified = rv.headers['ETag'], rv.headers['Last-Modified']
+        idx.downloads = ['zip']
+        rv = client.get('/', headers={'If-Modified-Since': last_modified})
+        assert rv.status_code == 200
+        rv = client.get('/', headers={'If-None-Match': etag})
+        assert rv.status_code == 200
+        etag = rv.headers['ETag']
+        app.jinja_loader.mapping['w.html'] = 'new'
+        rv = client.get('/', headers={'If-None-Match': etag})
+        assert rv.status_code == 200 and rv.data == b'new'
+        rv = client.get('/', headers={'If-None-Match': rv.headers['ETag']})
+        assert rv.status_code == 304
+
+
+class PageCacheTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.path = tempfile.mkdtemp()
+        self.pages = tempfile.mkdtemp()
+        open(os.path.join(self.path, 'a.txt'), 'w').close()
+
+    def tearDown(self):
+        shutil.rmtree(self.path)
+        shutil.rmtree(self.pages)
+
+    def make_app(self, page_cache, **kwargs):
+        app = Flask(__name__)
+        AutoIndex(app, self.path, page_cache=page_cache, **kwargs)
+        return app.test_client()
+
+    def test_memory(self):
+        page_cache = MemoryPageCache()
+        client = self.make_app(page_cache)
+        data = client.get('/').data
+        rv = client.get('/')
+        assert rv.data == data and 'Accept-Encoding' in rv.vary
+        rv = client.get('/', headers={'Accept-Encoding': 'gzip'})
+        assert rv.content_encoding == 'gzip'
+        assert gzip.decompress(rv.data) == data
+        assert page_cache.stats()['hits'] == 2
+        client.get('/?format=json').data
+        assert page_cache.stats()['size'] == 2
+        open(os.path.join(self.path, 'b.txt'), 'w').close()
+        assert b'b.txt' in client.get('/').data
+
+    def test_stream(self):
+        page_cache = MemoryPageCache()
+        client = self.make_app(page_cache, stream=True)
+        data = client.get('/').data
+        assert page_cache.stats()['size'] == 1
+        assert client.get('/').data == data
+        assert page_cache.stats()['hits'] == 1
+
+    def test_template_context(self):
+        app = Flask(__name__)
+        app.jinja_loader = DictLoader({'w.html': 'who={{ who }}'})
+        idx = AutoIndex(app, self.path, page_cache=MemoryPageCache(),
+                        add_url_rules=False)
+        @app.route('/a')
+        def a():
+            return idx.render_autoindex('.', template='w.html',
+                                        template_context={'who': 'A'})
+        @app.route('/b')
+        def b():
+            return idx.render_autoindex('.', template='w.html',
+                                        template_context={'who': 'B'})
+        @app.route('/c')
+        def c():
+            return idx.render_autoindex('.', template='w.html',
+                                        template_context={'who': object()})
+        client = app.test_client()
+        rv = client.get('/a')
+        assert rv.data == b'who=A'
+        assert client.get('/b').data == b'who=B'
+        rv = client.get('/b', headers={'If-None-Match': rv.headers['ETag']})
+        assert rv.status_code == 200 and rv.data == b'who=B'
+        assert client.get('/a', headers={'Host': 'other'}).headers['ETag'] \
+            != client.get('/a').headers['ETag']
+        rv = client.get('/c')
+        assert rv.status_code == 200 and 'ETag' not in rv.headers
+
+    def test_options_and_template(self):
+        plain = self.make_app(FileSystemPageCache(self.pages))
+        data = plain.get('/').data
+        assert b'download=zip' not in data
+        client = self.make_app(FileSystemPageCache(self.pages),
+                               downloads=('zip',), icon_mode='inline')
+        data = client.get('/').data
+        assert b'download=zip' in data and b'data:image/png' in data
+        app = Flask(__name__)
+        app.jinja_env.auto_reload = True
+        app.jinja_loader = DictLoader({'w.html': 'old'})
+        idx = AutoIndex(app, self.path, page_cache=MemoryPageCache(),
+                        add_url_rules=False)
+        @app.route('/')
+        def index():
+            return idx.render_autoindex('.', template='w.html')
+        assert app.test_client().get('/').data == b'old'
+        app.jinja_loader.mapping['w.html'] = 'new'
+        assert app.test_client().get('/').data == b'new'
+
+    def test_filesystem(self):
+        client = self.make_app(FileSystemPageCache(self.pages))
+        data = client.get('/').data
+        assert len(os.listdir(self.pages)) == 1
+        client2 = self.make_app(FileSystemPageCache(self.pages))
+        assert client2.get('/').data == data
+        assert len(os.listdir(self.pages)) == 1
+
+    def test_threshold(self):
+        page_cache = FileSystemPageCache(self.pages, threshold=2)
+        for x in range(4):
+            page_cache.set('page%d' % x, b'x')
+        assert sorted(os.listdir(self.pages)) == ['page2.page', 'page3.page']
+        assert page_cache.get('page3') == b'x'
+        assert page_cache.get('page0') is None
+        page_cache.clear()
+        assert not os.listdir(self.pages)
+
+    def test_prune_on_count(self):
+        page_cache = FileSystemPageCache(self.pages, threshold=8)
+        scans = []
+        pages = page_cache._pages
+        def count_scans():
+            scans.append(1)
+            return pages()
+        page_cache._pages = count_scans
+        for x in range(20):
+            page_cache.set('page%d' % x, b'x')
+        assert len(scans) == 6  # once in two writes past the threshold
+        assert len(os.listdir(self.pages)) <= 8
+
+
+class CompressTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.path = tempfile.mkdtemp()
+        self.css = os.path.join(self.path, 'style.css')
+        with open(self.css, 'w') as f:
+            f.write('body { color: red; }')
+        with gzip.open(self.css + '.gz', 'wb') as f:
+            f.write(b'body{color:red}')
+        self.app = Flask(__name__)
+        self.idx = AutoIndex(self.app, self.path, compress=True)
+
+    def tearDown(self):
+        shutil.rmtree(self.path)
+
+    def get(self, path, encoding=None):
+        headers = {'Accept-Encoding': encoding} if encoding else {}
+        return self.app.test_client().get(path, headers=headers)
+
+    def test_negotiate(self):
+        from werkzeug.http import parse_accept_header
+        accept = parse_accept_header('gzip;q=0.5, br')
+        assert negotiate(accept, ['br', 'gzip']) == 'br'
+        assert negotiate(accept, ['gzip']) == 'gzip'
+        assert negotiate(parse_accept_header('identity'), ['gzip']) is None
+
+    def test_listing(self):
+        plain = self.get('/')
+        assert plain.content_encoding is None
+        assert 'Accept-Encoding' in plain.vary
+        rv = self.get('/', 'gzip')
+        assert rv.content_encoding == 'gzip'
+        assert gzip.decompress(rv.data) == plain.data
+        self.idx.stream = True
+        rv = self.get('/', 'gzip')
+        assert gzip.decompress(rv.data) == plain.data
+
+    def test_etag(self):
+        plain = self.get('/').headers['ETag']
+        gzipped = self.get('/', 'gzip').headers['ETag']
+        assert plain != gzipped
+        for accept, etag, status in [('gzip', gzipped, 304),
+                                     ('identity', plain, 304),
+                                     ('gzip', plain, 200),
+                                     ('identity', gzipped, 200)]:
+            rv = self.app.test_client().get('/', headers={
+                'Accept-Encoding': accept, 'If-None-Match': etag})
+            assert rv.status_code == status
+            assert (rv.headers['ETag'] == etag) == (status == 304)
+
+    def test_sidecar(self):
+        rv = self.get('/style.css', 'gzip')
+        assert rv.content_encoding == 'gzip' and rv.mimetype == 'text/css'
+        assert gzip.decompress(rv.data) == b'body{color:red}'
+        assert self.get('/style.css').data == b'body { color: red; }'
+        os.utime(self.css + '.gz', (0, 0))
+        rv = self.get('/style.css', 'gzip')
+        assert rv.content_encoding is None
+        os.remove(self.css + '.gz')
+        os.mkdir(self.css + '.gz')
+        rv = self.get('/style.css', 'gzip')
+        assert rv.status_code == 200 and rv.content_encoding is None
+        assert rv.data == b'body { color: red; }'
+
+    def test_static(self):
+        rv = self.get('/__autoindex__/autoindex.css', 'gzip')
+        assert rv.content_encoding == 'gzip' and rv.mimetype == 'text/css'
+        path = os.path.join(os.path.dirname(flask_autoindex.__file__),
+                            'static', 'autoindex.css')
+        with open(path, 'rb') as f:
+            assert gzip.decompress(rv.data) == f.read()
+
+
+class RangeTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.path = tempfile.mkdtemp()
+        self.data = bytes(range(256)) * 4
+        with open(os.path.join(self.path, 'data.bin'), 'wb') as f:
+            f.write(self.data)
+        self.app = Flask(__name__)
+        self.idx = AutoIndex(self.app, self.path)
+
+    def tearDown(self):
+        shutil.rmtree(self.path)
+
+    def get(self, **headers):
+        return self.app.test_client().get('/data.bin', headers=headers)
+
+    def test_whole(self):
+        rv = self.get()
+        assert rv.status_code == 200 and rv.data == self.data
+        assert rv.accept_ranges == 'bytes'
+        assert rv.content_length == len(self.data)
+        assert self.get(**{'If-None-Match': rv.headers['ETag']}) \
+                   .status_code == 304
+
+    def test_content_disposition(self):
+        rv = self.get()
+        assert rv.headers['Content-Disposition'] == 'inline; filename=data.bin'
+        with open(os.path.join(self.path, u'caf\xe9 \u4e2d.bin'), 'wb') as f:
+            f.write(self.data)
+        rv = self.app.test_client().get('/caf%C3%A9%20%E4%B8%AD.bin')
+        assert rv.headers['Content-Disposition'] == \
+            'inline; filename="cafe .bin"; ' \
+            "filename*=UTF-8''caf%C3%A9%20%E4%B8%AD.bin"
+
+    def test_single(self):
+        self.idx.file_buffer_size = 7
+        rv = self.get(Range='bytes=10-99')
+        assert rv.status_code == 206 and rv.data == self.data[10:100]
+        assert rv.headers['Content-Range'] == 'bytes 10-99/1024'
+        assert self.get(Range='bytes=-10').data == self.data[-10:]
+        assert self.get(Range='bytes=1000-').data == self.data[1000:]
+        rv = self.get(Range='bytes=0-4,5-9')
+        assert rv.headers['Content-Range'] == 'bytes 0-9/1024'
+
+    def test_multiple(self):
+        rv = self.get(Range='bytes=0-1,10-11')
+        assert rv.status_code == 206
+        assert rv.mimetype == 'multipart/byteranges'
+        assert rv.content_length == len(rv.data)
+        boundary = rv.mimetype_params['boundary']
+        parts = rv.data.split(b'--' + b(boundary))
+        assert parts[-1] == b'--\r\n'
+        assert parts[1].endswith(b'\r\n\r\n\x00\x01\r\n')
+        assert b'Content-Range: bytes 10-11/1024' in parts[2]
+
+    def test_unsatisfiable(self):
+        rv = self.get(Range='bytes=2000-')
+        assert rv.status_code == 416
+        assert rv.headers['Content-Range'] == 'bytes */1024'
+
+    def test_if_range(self):
+        rv = self.get(Range='bytes=0-9', **{'If-Range': '"stale"'})
+        assert rv.status_code == 200 and rv.data == self.data
+        etag = self.get().headers['ETag']
+        rv = self.get(Range='bytes=0-9', **{'If-Range': etag})
+        assert rv.status_code == 206
+
+
+class OffloadTestCase(unittest.TestCase):
+
+    def get(self, path, **kwargs):
+        app = Flask(__name__)
+        AutoIndex(app, browse_root, **kwargs)
+        return app.test_client().get(path)
+
+    def test_accel_redirect(self):
+        rv = self.get('/blueprinttest/__init__.py',
+                      offload='x-accel-redirect', offload_root='/internal/')
+        assert rv.headers['X-Accel-Redirect'] == \
+               '/internal/blueprinttest/__init__.py'
+        assert rv.mimetype == 'text/x-python' and not rv.data
+        rv = self.get('/blueprinttest/__init__.py', offload='x-accel-redirect')
+        assert rv.headers['X-Accel-Redirect'] == '/blueprinttest/__init__.py'
+
+    def test_sendfile(self):
+        path = os.path.join(browse_root, 'blueprinttest', '__init__.py')
+        rv = self.get('/blueprinttest/__init__.py', offload='x-sendfile')
+        assert rv.headers['X-Sendfile'] == path
+        assert not rv.data and rv.content_length in (None, 0)
+        assert rv.headers['Content-Disposition'] == \
+            'inline; filename=__init__.py'
+        rv = self.get('/blueprinttest/__init__.py', offload='x-sendfile',
+                      offload_root='/srv/files')
+        assert rv.headers['X-Sendfile'] == '/srv/files/blueprinttest/__init__.py'
+
+    def test_checks(self):
+        rv = self.get('/../setup.py', offload='x-sendfile')
+        assert rv.status_code in (403, 404)
+        assert 'X-Sendfile' not in rv.headers
+        assert self.get('/nowhere', offload='x-sendfile').status_code == 404
+        assert 'X-Sendfile' not in self.get('/', offload='x-sendfile').headers
+        self.assertRaises(ValueError, self.get, '/', offload='nginx')
+
+
+class ArchiveTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.path = tempfile.mkdtemp()
+        os.mkdir(os.path.join(self.path, 'dir'))
+        os.mkdir(os.path.join(self.path, 'dir', 'empty'))
+        with open(os.path.join(self.path, 'dir', 'a.txt'), 'w') as f:
+            f.write('Hello, world!')
+        with open(os.path.join(self.path, 'dir', 'b.png'), 'wb') as f:
+            f.write(b'\x89PNG\r\n\x1a\n')
+        open(os.path.join(self.path, 'dir', '.hidden'), 'w').close()
+        self.app = Flask(__name__)
+        self.idx = AutoIndex(self.app, self.path,
+                             downloads=['zip', 'tar', 'tar.gz'])
+        self.names = ['dir/', 'dir/a.txt', 'dir/b.png', 'dir/empty/']
+
+    def tearDown(self):
+        shutil.rmtree(self.path)
+
+    def get(self, path):
+        return self.app.test_client().get(path)
+
+    def test_links_out_of_root(self):
+        outside = tempfile.mkdtemp()
+        try:
+            with open(os.path.join(outside, 'secret.txt'), 'w') as f:
+                f.write('secret')
+            os.symlink(outside, os.path.join(self.path, 'dir', 'out'))
+            os.symlink(os.path.join(outside, 'secret.txt'),
+                       os.path.join(self.path, 'dir', 'secret.txt'))
+            os.symlink(os.path.join(self.path, 'dir', 'a.txt'),
+                       os.path.join(self.path, 'dir', 'c.txt'))
+            rv = self.get('/dir?download=zip')
+            with zipfile.ZipFile(io.BytesIO(rv.data)) as zf:
+                assert sorted(zf.namelist()) == \
+                    sorted(self.names + ['dir/c.txt'])
+            rv = self.get('/dir?format=ndjson')
+            paths = [json.loads(line)['path']
+                     for line in rv.data.splitlines()]
+            assert 'dir/c.txt' in paths
+            assert not [p for p in paths if 'secret' in p or 'out' in p]
+        finally:
+            shutil.rmtree(outside)
+
+    def test_zip(self):
+        rv = self.get('/dir?download=zip')
+        assert rv.mimetype == 'application/zip'
+        assert 'filename=dir.zip' in rv.headers['Content-Disposition']
+        with zipfile.ZipFile(io.BytesIO(rv.data)) as zf:
+            assert zf.testzip() is None
+            assert zf.namelist() == self.names
+            assert zf.read('dir/a.txt') == b'Hello, world!'
+            stored = zf.getinfo('dir/b.png').compress_type
+            deflated = zf.getinfo('dir/a.txt').compress_type
+            assert (stored, deflated) == (zipfile.ZIP_STORED,
+                                          zipfile.ZIP_DEFLATED)
+
+    def test_tar(self):
+        for format, mode in [('tar', 'r:'), ('tar.gz', 'r:gz')]:
+            rv = self.get('/dir?download=' + format)
+            if format == 'tar':
+                assert len(rv.data) % tarfile.RECORDSIZE == 0
+            with tarfile.open(fileobj=io.BytesIO(rv.data), mode=mode) as tf:
+                names = [m.name + '/' if m.isdir() else m.name
+                         for m in tf.getmembers()]
+                assert names == self.names
+                f = tf.extractfile('dir/a.txt')
+                assert f.read() == b'Hello, world!'
+
+    def test_root(self):
+        rv = self.get('/?download=tar')
+        with tarfile.open(fileobj=io.BytesIO(rv.data)) as tf:
+            assert tf.getnames()[:2] == ['root', 'root/dir']
+
+    def test_limits(self):
+        self.idx.download_maxsize = 10
+        assert self.get('/dir?download=zip').status_code == 403
+        self.idx.downloads = ['zip']
+        self.idx.download_maxsize = None
+        rv = self.get('/dir?download=tar')
+        assert rv.status_code == 200 and rv.mimetype == 'text/html'
+        assert b'?download=zip' in rv.data
+        assert b'?download=tar' not in rv.data
+
+
+class BrowseArchiveTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.path = tempfile.mkdtemp()
+        with zipfile.ZipFile(os.path.join(self.path, 'a.zip'), 'w') as zf:
+            zf.writestr('a.txt', 'Hello, world!')
+            zf.writestr('dir/sub/b.txt', 'Hello, sub!')
+        for name, mode in [('a.tar', 'w'), ('a.tgz', 'w:gz'),
+                           ('a.tar.bz2', 'w:bz2'), ('a.tar.xz', 'w:xz')]:
+            with tarfile.open(os.path.join(self.path, name), mode) as tf:
+                for member, data in [('a.txt', b'Hello, world!'),
+                                     ('dir/sub/b.txt', b'Hello, sub!')]:
+                    tarinfo = tarfile.TarInfo(member)
+                    tarinfo.size = len(data)
+                    tf.addfile(tarinfo, io.BytesIO(data))
+        open(os.path.join(self.path, 'broken.zip'), 'w').close()
+        self.app = Flask(__name__)
+        self.idx = AutoIndex(self.app, self.path, browse_archives=True)
+
+    def tearDown(self):
+        shutil.rmtree(self.path)
+
+    def get(self, path):
+        return self.app.test_client().get(path)
+
+    def test_listing(self):
+        rv = self.get('/')
+        assert b'href="/a.zip/"' in rv.data
+        assert b'href="/broken.zip/"' in rv.data
+        for name in ['a.zip', 'a.tar', 'a.tgz']:
+            rv = self.get('/{0}/?format=json'.format(name))
+            entries = json.loads(rv.data)['entries']
+            assert [(ent['name'], ent['path'], ent['type'])
+                    for ent in entries] == [
+                ('dir', name + '/dir', 'directory'),
+                ('a.txt', name + '/a.txt', 'file'),
+            ]
+            assert entries[1]['size'] == 13
+            rv = self.get('/{0}/dir/sub'.format(name))
+            assert rv.status_code == 200
+            assert 'href="/{0}/dir/sub/b.txt"'.format(name) in \
+                rv.data.decode()
+            assert 'href="/{0}/dir"'.format(name) in rv.data.decode()
+
+    def test_member(self):
+        for name in ['a.zip', 'a.tar', 'a.tgz', 'a.tar.bz2', 'a.tar.xz']:
+            rv = self.get('/{0}/dir/sub/b.txt'.format(name))
+            assert rv.data == b'Hello, sub!'
+            assert rv.mimetype == 'text/plain'
+            assert rv.content_length == 11
+            etag = rv.headers['ETag']
+            rv = self.app.test_client().get(
+                '/{0}/dir/sub/b.txt'.format(name),
+                headers={'If-None-Match': etag})
+            assert rv.status_code == 304
+            assert self.get('/{0}/nothing'.format(name)).status_code == 404
+
+    def test_compressed_tar_member(self):
+        from flask_autoindex.archive import archive_index
+        path = os.path.join(self.path, 'a.tgz')
+        assert archive_index(path).compressed
+        assert not archive_index(os.path.join(self.path, 'a.tar')).compressed
+        for member, data in [('a.txt', b'Hello, world!'),
+                             ('dir/sub/b.txt', b'Hello, sub!')]:
+            with archive_index(path).open(member) as f:
+                assert f.read() == data
+
+    def test_archive_itself(self):
+        rv = self.get('/a.zip')
+        assert rv.mimetype == 'application/zip'
+        with zipfile.ZipFile(io.BytesIO(rv.data)) as zf:
+            assert zf.read('a.txt') == b'Hello, world!'
+        assert self.get('/broken.zip/a.txt').status_code == 404
+        self.idx.browse_archives = False
+        assert self.get('/a.zip/a.txt').status_code == 404
+        assert b'href="/a.zip/"' not in self.get('/').data
+
+    def test_index_cache(self):
+        from flask_autoindex.archive import archive_index
+        path = os.path.join(self.path, 'a.zip')
+        index = archive_index(path)
+        assert archive_index(path) is index
+        with zipfile.ZipFile(path, 'a') as zf:
+            zf.writestr('c.txt', 'Hello, again!')
+        os.utime(path, (time.time() + 10, time.time() + 10))
+        assert archive_index(path) is not index
+        assert self.get('/a.zip/c.txt').data == b'Hello, again!'
+
+
+class IconModeTestCase(unittest.TestCase):
+
+    def get(self, path, **kwargs):
+        self.app = Flask(__name__)
+        self.idx = AutoIndex(self.app, browse_root, **kwargs)
+        return self.app.test_client().get(path)
+
+    def test_url(self):
+        rv = self.get('/static')
+        assert re.search(br'<img src="/__icons__/\w+/folder.png" />', rv.data)
+        assert b'__icons__.css' not in rv.data
+
+    def test_sprite(self):
+        rv = self.get('/static', icon_mode='sprite')
+        assert b'<span class="sprite icon-folder-png"></span>' in rv.data
+        assert b'/__icons__/' not in rv.data
+        href = re.search(r'href="(/__icons__\.css\?v=\w+)"',
+                         rv.data.decode()).group(1)
+        client = self.app.test_client()
+        rv = client.get(href)
+        assert rv.mimetype == 'text/css'
+        assert rv.cache_control.max_age == 365 * 24 * 60 * 60
+        css = rv.data.decode()
+        assert '.icon-folder-png { background-image: url("data:image/png;' \
+            in css
+        assert '.icon-page_white_python-png' in css
+        assert '.icon-bug-png' not in css
+        version = self.idx.icon_sheet.version
+        self.idx.add_icon_rule('bug.png', ext='txt')
+        assert self.idx.icon_sheet.version != version
+        assert '.icon-bug-png' in client.get('/__icons__.css').data.decode()
+        rv = client.get('/static')
+        assert b'<span class="sprite icon-bug-png"></span>' in rv.data
+        etag = client.get('/__icons__.css').headers['ETag']
+        rv = client.get('/__icons__.css', headers={'If-None-Match': etag})
+        assert rv.status_code == 304
+
+    def test_inline(self):
+        rv = self.get('/static', icon_mode='inline')
+        assert b'<img src="data:image/png;base64,' in rv.data
+        assert b'/__icons__/' not in rv.data
+        self.idx.add_icon_rule(lambda ent: 'http://example.com/icon.png')
+        rv = self.app.test_client().get('/static')
+        assert b'<img src="http://example.com/icon.png" />' in rv.data
+
+    def test_invalid(self):
+        self.assertRaises(ValueError, self.get, '/', icon_mode='sprites')
+
+
+class AssetTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.app = Flask(__name__)
+        self.idx = AutoIndex(self.app, browse_root)
+        self.client = self.app.test_client()
+
+    def urls(self, path):
+        return re.findall(r'(?:src|href)="(/__(?:autoindex|icons)__/[^"]+)"',
+                          self.client.get(path).data.decode())
+
+    def test_versioned_urls(self):
+        urls = self.urls('/static')
+        assert '/__autoindex__/autoindex.css?v=' in ' '.join(urls)
+        assert re.search(r'/__icons__/\w+/folder\.png', ' '.join(urls))
+        for url in urls:
+            rv = self.client.get(url)
+            assert rv.status_code == 200
+            assert rv.cache_control.immutable
+            assert rv.cache_control.max_age == 365 * 24 * 60 * 60
+            assert not rv.cache_control.no_cache
+
+    def test_unversioned_urls(self):
+        for url in ['/__autoindex__/autoindex.css', '/__icons__/folder.png',
+                    '/__icons__/0123456789ab/folder.png']:
+            rv = self.client.get(url)
+            assert rv.status_code == 200
+            assert rv.cache_control.no_cache
+            assert not rv.cache_control.immutable
+        assert self.client.get('/__autoindex__/nothing').status_code == 404
+
+    def test_asset(self):
+        path = os.path.join(os.path.dirname(flask_autoindex.__file__),
+                            'static', 'autoindex.css')
+        with open(path, 'rb') as f:
+            css = f.read()
+        rv = self.client.get('/__autoindex__/autoindex.css')
+        assert rv.data == css and rv.mimetype == 'text/css'
+        rv = self.client.get('/__autoindex__/autoindex.css',
+                             headers={'Accept-Encoding': 'gzip'})
+        assert rv.content_encoding == 'gzip'
+        assert gzip.decompress(rv.data) == css
+        rv = self.client.get('/__autoindex__/autoindex.css',
+                             headers={'Accept-Encoding': 'gzip',
+                                      'If-None-Match': rv.headers['ETag']})
+        assert rv.status_code == 304
+
+    def test_icon(self):
+        rv = self.client.get('/__icons__/folder.png')
+        assert rv.mimetype == 'image/png'
+        assert rv.data.startswith(b'\x89PNG')
+        rv = self.client.get('/__icons__/folder.png',
+                             headers={'If-None-Match': rv.headers['ETag']})
+        assert rv.status_code == 304
+        assert self.client.get('/__icons__/nothing.png').status_code == 404
+
+    def test_icon_directory(self):
+        path = tempfile.mkdtemp()
+        try:
+            with open(os.path.join(path, 'folder.png'), 'wb') as f:
+                f.write(b'custom folder')
+            with open(os.path.join(path, 'custom.png'), 'wb') as f:
+                f.write(b'custom')
+            assert self.idx.icon_table.find('custom.png') is None
+            self.idx.silk.register_icon_directory(path)
+            assert self.idx.icon_table.find('custom.png') == \
+                os.path.join(path, 'custom.png')
+            assert self.client.get('/__icons__/folder.png').data == \
+                b'custom folder'
+            assert self.client.get('/__icons__/page_white.png').status_code \
+                == 200
+        finally:
+            self.idx.silk.directories.remove(path)
+            shutil.rmtree(path)
+        assert self.idx.icon_table.find('custom.png') is None
+
+
+class TemplateCacheTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.path = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.path)
+
+    def make_app(self):
+        app = Flask(__name__)
+        idx = AutoIndex(app, browse_root, bytecode_cache=self.path)
+        return app, idx
+
+    def test_warm_up(self):
+        app, idx = self.make_app()
+        templates = idx.warm_up()
+        assert [t.name for t in templates] == ['__autoindex__/autoindex.html',
+                                               '__autoindex__/macros.html']
+        assert len(os.listdir(self.path)) == 2
+        app2, idx2 = self.make_app()
+        def compile(*args, **kwargs):
+            raise AssertionError('compiled again')
+        app2.jinja_env.compile = compile
+        idx2.warm_up()
+        rv = app2.test_client().get('/static')
+        assert rv.status_code == 200
+        assert b'helloworld.txt' in rv.data
+
+    def test_other_templates(self):
+        app, idx = self.make_app()
+        app.jinja_loader = DictLoader({'page.html': 'Hello'})
+        with app.app_context():
+            assert render_template('page.html') == 'Hello'
+        assert os.listdir(self.path) == []
+
+    def test_blueprint(self):
+        app = Flask(__name__)
+        blueprint = Blueprint('files', __name__)
+        idx = AutoIndex(blueprint, browse_root, bytecode_cache=self.path)
+        app.register_blueprint(blueprint, url_prefix='/files')
+        with app.app_context():
+            idx.warm_up()
+        assert len(os.listdir(self.path)) == 2
+        rv = app.test_client().get('/files/static')
+        assert b'/files/static/helloworld.txt' in rv.data
+
+
+class NativeRowsTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.path = tempfile.mkdtemp()
+        os.mkdir(os.path.join(self.path, 'sub dir'))
+        for name in ['a&b <c>.txt', u'\uc548\ub155.py', "it's #1?.png",
+                     'empty.txt']:
+            with open(os.path.join(self.path, 'sub dir', name), 'w') as f:
+                f.write('' if name == 'empty.txt' else 'x' * len(name) * 99)
+        with zipfile.ZipFile(os.path.join(self.path, 'sub dir',
+                                          'pack.zip'), 'w') as f:
+            f.writestr('inner/a.txt', 'a')
+
+    def tearDown(self):
+        shutil.rmtree(self.path)
+
+    def get(self, path, **options):
+        rvs = []
+        for native_rows in (False, True):
+            app = Flask(__name__)
+            AutoIndex(app, self.path, native_rows=native_rows,
+                      browse_archives=True, **options)
+            rv = app.test_client().get(path)
+            assert rv.status_code == 200
+            rvs.append(rv.data)
+        return rvs
+
+    def test_same_markup(self):
+        for path in ['/', '/sub%20dir/pack.zip/', '/sub%20dir/pack.zip/inner',
+                     '/?sort_by=size', '/sub%20dir']:
+            jinja, native = self.get(path)
+            assert jinja == native, path
+        assert b'href="/sub%20dir/a%26b%20%3Cc%3E.txt"' in native
+        assert b'a&amp;b &lt;c&gt;.txt</a>' in native
+
+    def test_options(self):
+        for options in [dict(stream=True), dict(icon_mode='sprite'),
+                        dict(per_page=2)]:
+            jinja, native = self.get('/sub%20dir', **options)
+            assert jinja == native, options
+
+    def test_blueprint(self):
+        rvs = []
+        for native_rows in (False, True):
+            app = Flask(__name__)
+            blueprint = Blueprint('files', __name__)
+            AutoIndex(blueprint, self.path, native_rows=native_rows)
+            app.register_blueprint(blueprint, url_prefix='/files')
+            rvs.append(app.test_client().get('/files/sub%20dir').data)
+        assert rvs[0] == rvs[1]
+        assert b'href="/files/sub%20dir/empty.txt"' in rvs[1]
+
+    def test_custom_template(self):
+        app = Flask(__name__)
+        app.jinja_loader = DictLoader({'autoindex.html': 'custom'})
+        AutoIndex(app, self.path, native_rows=True)
+        assert app.test_client().get('/').data == b'custom'
+
+    def test_entry_macro(self):
+        app = Flask(__name__)
+        app.jinja_loader = DictLoader({'autoindex.html': (
+            '{% from "__autoindex__/macros.html" import entry with context %}'
+            '{% for ent in entries %}{{ entry(ent) }}{% endfor %}')})
+        AutoIndex(app, self.path, native_rows=True, browse_archives=True)
+        data = app.test_client().get('/sub%20dir').get_data(as_text=True)
+        assert data.count('<tr>') == 6
+        assert 'href="/sub%20dir/pack.zip/">browse</a>' in data
+        assert 'Parent folder' in data
+
+    def test_chunks(self):
+        app = Flask(__name__)
+        idx = AutoIndex(app, self.path)
+        with app.test_request_context('/'):
+            entries = list(idx.rootdir.explore())
+            rows = RowRenderer('autoindex', idx._icon_renderer())
+            chunks = rows.write(entries * 3, [], buffer=2)
+        assert len(chunks) == 2
+        assert all(isinstance(chunk, bytes) for chunk in chunks)
+        assert b''.join(chunks).count(b'<tr>') == 3
+
 
 def suite():
     suite = unittest.TestSuite()
     suite.addTest(unittest.makeSuite(RootDirectoryTestCase))
     suite.addTest(unittest.makeSuite(DirectoryTestCase))
     suite.addTest(unittest.makeSuite(FileTestCase))
+    suite.addTest(unittest.makeSuite(ExploreTestCase))
+    suite.addTest(unittest.makeSuite(CacheTestCase))
+    suite.addTest(unittest.makeSuite(WatchTestCase))
+    suite.addTest(unittest.makeSuite(MimetypeTestCase))
     suite.addTest(unittest.makeSuite(ApplicationTestCase))
     suite.addTest(unittest.makeSuite(SortTestCase))
+    suite.addTest(unittest.makeSuite(PaginationTestCase))
+    suite.addTest(unittest.makeSuite(StreamTestCase))
+    suite.addTest(unittest.makeSuite(JSONTestCase))
+    suite.addTest(unittest.makeSuite(ExportTestCase))
+    suite.addTest(unittest.makeSuite(ConditionalTestCase))
+    suite.addTest(unittest.makeSuite(PageCacheTestCase))
+    suite.addTest(unittest.makeSuite(CompressTestCase))
+    suite.addTest(unittest.makeSuite(RangeTestCase))
+    suite.addTest(unittest.makeSuite(OffloadTestCase))
+    suite.addTest(unittest.makeSuite(ArchiveTestCase))
+    suite.addTest(unittest.makeSuite(BrowseArchiveTestCase))
+    suite.addTest(unittest.makeSuite(IconModeTestCase))
+    suite.addTest(unittest.makeSuite(AssetTestCase))
+    suite.addTest(unittest.makeSuite(TemplateCacheTestCase))
+    suite.addTest(unittest.makeSuite(NativeRowsTestCase))
     # These cases will be passed on Flask next generation.
     # suite.addTest(unittest.makeSuite(SubdomainTestCase))
     # suite.addTest(unittest.makeSuite(WithoutSubdomainTestCase))